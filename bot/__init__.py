@@ -1,3 +1,3 @@
 from __future__ import absolute_import
 
-from .api import announce, request_announce
+from .api import announce, request_announce, np_update
@@ -6,6 +6,7 @@ from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer as JSONServer
 import jsonrpclib
 
 import manager.song
+import manager.status
 import config
 
 jsonrpclib.config.use_jsonclass = False
@@ -48,8 +49,12 @@ def request_announce(session, song):
 def announce(session):
     session.announce()
 
+@clientify
+def np_update(session, state):
+    manager.status.np_cache.set(state)
+
 def run_rpc_server(config, session):
-    funcs = [request_announce, announce]
+    funcs = [request_announce, announce, np_update]
 
     server = JSONServer((config.host, config.port),
                         encoding="utf8", logRequests=False)
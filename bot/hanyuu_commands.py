@@ -70,14 +70,15 @@ def np(server, nick, channel, text, hostmask):
     status = manager.Status()
     np = manager.NP()
     if status.online:
+        stats = np.stats()
         message = u"Now playing:{c4} '{np}' {c}[{curtime}/{length}]({listeners} listeners), {faves} fave{fs}, played {times} time{ts}, {c3}LP:{c} {lp}".format(
             np=np.metadata, curtime=np.positionf,
             length=np.lengthf, listeners=status.listeners,
-            faves=np.favecount,
-            fs="" if (np.favecount == 1) else "s",
-            times=np.playcount,
-            ts="" if (np.playcount == 1) else "s",
-            lp=np.lpf,
+            faves=stats.favecount,
+            fs="" if (stats.favecount == 1) else "s",
+            times=stats.playcount,
+            ts="" if (stats.playcount == 1) else "s",
+            lp=stats.lpf,
             **irc_colours)
     else:
         message = u"Stream is currently down."
@@ -338,14 +339,16 @@ spam = bootstrap.Switch(True)
 def announce(server, spam=spam):
     np = manager.NP()
     status = manager.Status()
+    # A new song started, so whatever we had cached is outdated
+    stats = np.stats(refresh=True)
     if not spam:  # No more requiring a fave for a now starting announce. (Hiroto)
         message = u"Now starting:{c4} '{np}' {c}[{length}]({listeners} listeners), {faves} fave{fs}, played {times} time{ts}, {c3}LP:{c} {lp}".format(
             np=np.metadata, length=np.lengthf, listeners=status.listeners,
-            faves=np.favecount,
-            fs="" if (np.favecount == 1) else "s",
-            times=np.playcount,
-            ts="" if (np.playcount == 1) else "s",
-            lp=np.lpf,
+            faves=stats.favecount,
+            fs="" if (stats.favecount == 1) else "s",
+            times=stats.playcount,
+            ts="" if (stats.playcount == 1) else "s",
+            lp=stats.lpf,
             **irc_colours)
         server.privmsg("#r/a/dio", message)
         spam.reset()
@@ -380,61 +383,26 @@ def random(server, nick, channel, text, hostmask):
     else:
         return
 
-    def request_from_list(songs):
-        while len(songs) > 0:
-            song = songs.pop(_random.randrange(len(songs)))
-            value = nick_request_song(song.id, hostmask)
-            if isinstance(value, tuple):
-                message = hanyuu_response(value[0], value[1])
-                if value[0] == 4:
-                    continue
-                else:
-                    break
-            elif isinstance(value, manager.Song):
-                manager.Queue().append_request(song)
-                request_announce(server, song)
-                return
+    empty = u"Your query did not have any results"
     if command.lower().strip() == "fave" or command.lower().strip() == "f" or command.lower().strip() == "favorite":
-        songs = manager.Song.nick(nick, limit=None, tracks=True)
-        request_from_list(songs)
-        return
+        trackids = sample_faves(nick)
     elif re.match(r"^f(ave|avorite)? (.*)", command):
-        fave_nick = re.match(r"^f(ave|avorite)? (.*)", command).groups()[2]
-        songs = manager.Song.nick(fave_nick, limit=None, tracks=True)
-        request_from_list(songs)
-        return
+        fave_nick = re.match(r"^f(ave|avorite)? (.*)", command).groups()[1]
+        trackids = sample_faves(fave_nick)
     elif command:
-	result = manager.Song.search(command, limit=300)
-	message = None
-	_random.shuffle(result)
-	for song in result:
-		value = nick_request_song(song.id, hostmask)
-		if isinstance(value, tuple):
-			message = hanyuu_response(value[0], value[1])
-			if value[0] == 4:
-				continue
-			else:
-				break
-		elif isinstance(value, manager.Song):
-			manager.Queue().append_request(song)
-			request_announce(server, song)
-			return
-	if message is None:
-		message = u"Your query did not have any results"
+        result = manager.Song.search(command, limit=300)
+        trackids = [song.id for song in result]
+        _random.shuffle(trackids)
     else:
-        while True:
-            song = manager.Song.random()
-            value = nick_request_song(song.id, hostmask)
-            if isinstance(value, tuple):
-                message = hanyuu_response(value[0], value[1])
-                if value[0] == 4:
-                    continue
-                else:
-                    break
-            elif isinstance(value, manager.Song):
-                manager.Queue().append_request(song)
-                request_announce(server, song)
-                return
+        # The catalog can be a bit behind, give the database a few picks
+        catalog = manager.Catalog()
+        trackids = set(catalog.random(requestable=True) for i in xrange(5))
+        trackids = [trackid for trackid in trackids if trackid is not None]
+        empty = u"There are no songs that can be requested right now"
+
+    message = request_first(server, trackids, hostmask, empty)
+    if message is None:
+        return
     if mode == "@":
         server.privmsg(channel, message)
     else:
@@ -454,21 +422,9 @@ def lucky(server, nick, channel, text, hostmask):
         server.notice(nick, message)
         return
     result = manager.Song.search(query, limit=300)
-    message = None
-    for song in result:
-        value = nick_request_song(song.id, hostmask)
-        if isinstance(value, tuple):
-            message = hanyuu_response(value[0], value[1])
-            if value[0] == 4:
-                continue
-            else:
-                break
-        elif isinstance(value, manager.Song):
-            manager.Queue().append_request(song)
-            request_announce(server, song)
-            return
+    message = request_first(server, [song.id for song in result], hostmask)
     if message is None:
-        message = u"Your query did not have any results"
+        return
     if mode == "@":
         server.privmsg(channel, message)
     else:
@@ -478,6 +434,34 @@ lucky.handler = (
     "on_text", r'[.!@]l(ucky)?\b', irc.ALL_NICKS, irc.MAIN_CHANNELS)
 
 
+def sample_faves(nick, k=10):
+    """Returns up to `k` random track ids from the favorites of `nick`,
+    preferring ones that can be requested right now"""
+    songs = manager.Song.sample_nick(nick, k=k, requestable=True)
+    if not songs:
+        # Nothing requestable, still pick some to tell how long to wait
+        songs = manager.Song.sample_nick(nick, k=k, tracks=True)
+    return [song.id for song in songs if song.id]
+
+
+def request_first(server, trackids, hostmask,
+                  empty=u"Your query did not have any results"):
+    """Requests the first requestable track in `trackids` and announces it.
+    Returns None if a track got requested, else the message to reply with,
+    `empty` when there are no tracks to try"""
+    trackids = [trackid for trackid in trackids if trackid]
+    if not trackids:
+        return empty
+    value = nick_request_songs(trackids, hostmask)
+    if value == 1:
+        return empty
+    if isinstance(value, manager.Song):
+        manager.Queue().append_request(value)
+        request_announce(server, value)
+        return None
+    return hanyuu_response(value[0], value[1])
+
+
 def search(server, nick, channel, text, hostmask):
     def format_date(dt):
         minute = 60
@@ -520,13 +504,16 @@ def search(server, nick, channel, text, hostmask):
         except (ValueError):
             message = []
     except (ValueError):
+        songs = manager.Song.search(query)
+        requestable = manager.Catalog().requestable(
+            [song.id for song in songs])
         message = [u"{col_code}{meta} {c3}({trackid}){c} (LP:{c5}{lp}{c})"
                    .format(
                        col_code=irc_colours[
-                           'c3' if song.requestable else 'c4'],
+                           'c3' if can_request else 'c4'],
                    meta=song.metadata, trackid=song.id,
                    lp=format_date(song.lpd), **irc_colours) for
-                   song in manager.Song.search(query)]
+                   song, can_request in zip(songs, requestable)]
     if len(message) > 0:
         message = u" | ".join(message)
     else:
@@ -714,6 +701,20 @@ request_help.handler = ("on_text", r'.*how.+request',
                         irc.ALL_NICKS, irc.MAIN_CHANNELS)
 
 
+_lastfm_network = None
+
+
+def lastfm_network():
+    """Returns the shared pylast network object, so its client and cache
+    aren't built again for every command"""
+    global _lastfm_network
+    import pylast
+    if _lastfm_network is None:
+        _lastfm_network = pylast.LastFMNetwork(
+            api_key=config.lastfm_key, api_secret=config.lastfm_secret)
+    return _lastfm_network
+
+
 def lastfm_listening(server, nick, channel, text, hostmask):
     import pylast
     message = u''
@@ -728,8 +729,7 @@ def lastfm_listening(server, nick, channel, text, hostmask):
             username = row['user']
         else:
             username = nick
-        network = pylast.LastFMNetwork(
-            api_key=config.lastfm_key, api_secret=config.lastfm_secret)
+        network = lastfm_network()
         user = network.get_user(username)
         try:
             try:
@@ -786,8 +786,7 @@ def lastfm_setuser(server, nick, channel, text, hostmask):
     message = u''
     if match and match.group('user') != '':
         username = match.group('user')
-        network = pylast.LastFMNetwork(
-            api_key=config.lastfm_key, api_secret=config.lastfm_secret)
+        network = lastfm_network()
         try:
             user = network.get_user(username)
             user.get_recent_tracks()
@@ -883,6 +882,8 @@ def hanyuu_response(response, delay):
         for (d, r) in song_messages:
             if delay <= d:
                 return r
+    elif response == 5:
+        return irc_colours['c4'] + u"That song can't be requested."
     return u"I have no idea what's happening~"
 
 
@@ -907,6 +908,74 @@ def small_time_format(t, long_time=True):
     return retval
 
 
+def nick_request_songs(trackids, host=None):
+    """Same as nick_request_song but for a list of candidate track ids, the
+    first one that can be requested gets requested.
+
+    Checking the hostmask and the candidates takes two queries no matter
+    how many candidates there are. Returns the requested Song, 1 if none
+    of the candidates exist, (2, delay) or (3, 0) like nick_request_song,
+    (5, 0) if none of them are usable, or (4, delay) with the delay of the
+    usable candidate that can be requested the soonest.
+    """
+    import time
+    trackids = list(trackids)
+    if not trackids:
+        return 1
+    now = int(time.time())
+    with manager.MySQLCursor() as cur:
+        cur.execute("SELECT (SELECT id FROM `nickrequesttime` WHERE \
+            `host`=%(host)s LIMIT 1) AS id, (SELECT UNIX_TIMESTAMP(time) \
+            FROM `nickrequesttime` WHERE `host`=%(host)s LIMIT 1) AS timestamp, \
+            (SELECT isafkstream FROM `streamstatus` WHERE `id`=0) AS afk;",
+                    {"host": host})
+        row = cur.fetchone()
+        hostmask_id = row['id']
+        if host and row['timestamp'] is not None and \
+                now - int(row['timestamp']) < 3600:
+            return (2, 3600 - (now - int(row['timestamp'])))
+        if row['afk'] != 1:
+            return (3, 0)
+
+        cur.execute("SELECT id, usable, UNIX_TIMESTAMP(lastplayed) AS lp, \
+            UNIX_TIMESTAMP(lastrequested) AS lr, requestcount, priority \
+            FROM `tracks` WHERE `id` IN ({ids});".format(
+                ids=", ".join(["%s"] * len(trackids))), trackids)
+        rows = dict((row['id'], row) for row in cur)
+        if not rows:
+            return 1
+
+        catalog = manager.Catalog()
+        catalog.store([(row['id'], row['usable'], row['lp'], row['lr'],
+                        row['requestcount'], row['priority'])
+                       for row in rows.itervalues()])
+        # Unusable tracks wait forever, unknown ones are skipped
+        trackids = [trackid for trackid in trackids if trackid in rows]
+        waits = catalog.seconds_until_requestable(trackids, now)
+        for trackid, wait in zip(trackids, waits):
+            if wait == 0:
+                break
+        else:
+            if min(waits) == float("inf"):
+                return (5, 0)
+            return (4, int(min(min(waits), 20000000)))
+
+        if host:
+            if hostmask_id:
+                cur.execute(
+                    "UPDATE `nickrequesttime` SET `time`=NOW() WHERE `id`=%s LIMIT 1;", (hostmask_id,))
+            else:
+                cur.execute(
+                    "INSERT INTO `nickrequesttime` (host, time) VALUES (%s, NOW());", (host,))
+        cur.execute(
+            "UPDATE `tracks` SET `lastrequested`=NOW(), requestcount=requestcount+2 WHERE `id`=%s", (trackid,))
+        catalog.touch(trackid, lr=now,
+                      requestcount=rows[trackid]['requestcount'] + 2)
+    song = manager.Song(trackid)
+    song.update_index()
+    return song
+
+
 def nick_request_song(trackid, host=None):
     """Gets data about the specified song, for the specified hostmask.
     If the song didn't exist, it returns 1.
@@ -954,6 +1023,9 @@ def nick_request_song(trackid, host=None):
             row = cur.fetchone()
             song_lp = row['lp']
             song_lr = row['lr']
+            # keep the catalog used by !random in line with the database
+            manager.Catalog().touch(trackid, lp=song_lp, lr=song_lr,
+                                    requestcount=row['requestcount'])
             if int(time.time()) - song_lp < requests_.songdelay(row['requestcount']) or int(time.time()) - song_lr < requests_.songdelay(row['requestcount']):
                 can_song = False
                 if delaytime == 0:
@@ -979,5 +1051,7 @@ def nick_request_song(trackid, host=None):
                         "INSERT INTO `nickrequesttime` (host, time) VALUES (%s, NOW());", (host,))
             cur.execute(
                 "UPDATE `tracks` SET `lastrequested`=NOW(), requestcount=requestcount+2 WHERE `id`=%s", (trackid,))
+            manager.Catalog().touch(trackid, lr=time.time(),
+                                    requestcount=row['requestcount'] + 2)
             song.update_index()
             return song
@@ -3,6 +3,8 @@ import argparse
 import json
 
 from . import irc, api
+import manager.song
+import manager.status
 
 
 def jsonfile(filename):
@@ -25,6 +27,10 @@ def main():
     # END TODO
     args = parser.parse_args()
 
+    # Favorites need the songid of a song, get them all in one go
+    manager.song.Song.warm_songids()
+    manager.status.lp_cache.load()
+
     session = irc.run_irc_client(args.config)
     api.run_rpc_server(conf, session)
 
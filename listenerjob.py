@@ -1,14 +1,20 @@
 import manager
 
-with manager.MySQLCursor() as cur:
-    cur.execute("SELECT * FROM `streamstatus`;")
-    if cur.rowcount == 1:
-        row = cur.fetchone()
-        l = row['listeners']
-        dj = row['djid']
-    else:
-        l = 0
-        dj = 0
-    cur.execute("INSERT INTO `listenlog` (`listeners`, `dj`) VALUES ('%s', %s);" % (l, dj))
+
+def run():
+    """Logs the current listener count and dj to `listenlog`"""
+    with manager.MySQLCursor() as cur:
+        cur.execute("SELECT * FROM `streamstatus`;")
+        if cur.rowcount == 1:
+            row = cur.fetchone()
+            l = row['listeners']
+            dj = row['djid']
+        else:
+            l = 0
+            dj = 0
+        cur.execute("INSERT INTO `listenlog` (`listeners`, `dj`) VALUES (%s, %s);", (l, dj))
 
 # i did not include the rest as it is not needed.
+
+if __name__ == "__main__":
+    run()
@@ -20,6 +20,12 @@ class StatusUpdate(object):
         # Start streamstatus updater
         m.start_updater()
 
+        # Resolving songids is done on every track change
+        m.Song.warm_songids()
+
+        # Keep track lengths probed so nobody has to open audio files
+        m.start_prober()
+
         self.mode = None
 
         self.status = m.Status()
@@ -28,6 +34,9 @@ class StatusUpdate(object):
         self.listener = None
         self.switching = False
 
+        # Fetch the stream status here and share it with other processes
+        m.start_status_poller()
+
     def switch_dj(self, force=False):
         if (force):
             self.switching = Switch(True)
@@ -5,3 +5,11 @@ from .song import *
 from .queue import *
 from .status import *
 from .updater import *
+from .writer import *
+from .catalog import *
+from .length import *
+from .indexer import *
+from .searchbackend import *
+from .snapshot import *
+from .timeseries import *
+from .httpclient import *
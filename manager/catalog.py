@@ -0,0 +1,204 @@
+from __future__ import absolute_import
+import time
+import logging
+import threading
+
+import numpy
+
+from .util import MySQLNormalCursor
+import bootstrap
+
+
+def songdelays(requestcounts):
+    """Vectorized version of util.songdelay, returns an array with the delay
+    in seconds for each requestcount in the array `requestcounts`"""
+    rc = numpy.minimum(numpy.asarray(requestcounts, dtype=numpy.int64), 30)
+    high = (599955 * numpy.exp(0.0372 * rc) + 0.5).astype(numpy.int64)
+    return numpy.where(rc <= 7,
+                       -11057 * rc ** 2 + 172954 * rc + 81720,
+                       high)
+
+
+class Catalog(object):
+    """In-memory columnar copy of the columns of `tracks` needed to pick
+    and request songs.
+
+    Every column is a NumPy array, with `index` mapping a track id to its
+    position in them. The catalog is loaded on first use, after that only
+    rows that are new or got played or requested since the last check are
+    read again every `refresh` seconds, and everything is reloaded every
+    `reload` seconds to pick up changes to `usable` and `priority`.
+    """
+    __metaclass__ = bootstrap.Singleton
+    refresh = 60
+    reload = 3600
+    columns = (("usable", numpy.bool_),
+               ("lp", numpy.float64),
+               ("lr", numpy.float64),
+               ("requestcount", numpy.int64),
+               ("priority", numpy.int64))
+
+    def __init__(self):
+        super(Catalog, self).__init__()
+        self.lock = threading.RLock()
+        self.refreshed = 0
+        self.reloaded = 0
+        self.clear()
+
+    def clear(self):
+        self.index = {}
+        self.ids = numpy.zeros(0, dtype=numpy.int64)
+        for name, dtype in self.columns:
+            setattr(self, name, numpy.zeros(0, dtype=dtype))
+
+    @property
+    def loaded(self):
+        return self.reloaded != 0
+
+    def check(self):
+        """Reloads or refreshes the catalog if it is due"""
+        now = time.time()
+        with self.lock:
+            if now - self.reloaded > self.reload:
+                self.load()
+            elif now - self.refreshed > self.refresh:
+                self.load(since=self.refreshed)
+
+    def load(self, since=None):
+        """Reads all rows from `tracks`, or only those added, played or
+        requested after unixtime `since`"""
+        query = "SELECT id, usable, UNIX_TIMESTAMP(lastplayed), \
+        UNIX_TIMESTAMP(lastrequested), requestcount, priority FROM tracks"
+        now = time.time()
+        with MySQLNormalCursor() as cur:
+            if since is None:
+                cur.execute(query + ";")
+            else:
+                # A bit of slack for clock differences with the database
+                cur.execute(query + " WHERE id > %s OR \
+                lastplayed > FROM_UNIXTIME(%s) OR \
+                lastrequested > FROM_UNIXTIME(%s);",
+                            (self.max_id, since - 5, since - 5))
+            rows = cur.fetchall()
+        with self.lock:
+            if since is None:
+                self.clear()
+                self.reloaded = now
+            self.store(rows)
+            self.refreshed = now
+        if since is None:
+            logging.info("Loaded %d tracks into the catalog", len(rows))
+
+    def store(self, rows):
+        """Adds or replaces rows, a row is a sequence of (id, usable,
+        lastplayed, lastrequested, requestcount, priority) with the times
+        as unixtime"""
+        if not rows:
+            return
+        ids = numpy.array([row[0] for row in rows], dtype=numpy.int64)
+        values = [numpy.array([row[i + 1] or 0 for row in rows], dtype=dtype)
+                  for i, (name, dtype) in enumerate(self.columns)]
+        with self.lock:
+            positions = numpy.array([self.index.get(trackid, -1)
+                                     for trackid in ids], dtype=numpy.int64)
+            known = positions >= 0
+            for (name, dtype), column in zip(self.columns, values):
+                getattr(self, name)[positions[known]] = column[known]
+
+            new = ~known
+            if new.any():
+                start = len(self.ids)
+                self.ids = numpy.concatenate((self.ids, ids[new]))
+                for (name, dtype), column in zip(self.columns, values):
+                    setattr(self, name, numpy.concatenate(
+                        (getattr(self, name), column[new])))
+                for offset, trackid in enumerate(ids[new]):
+                    self.index[int(trackid)] = start + offset
+
+    @property
+    def max_id(self):
+        return int(self.ids.max()) if len(self.ids) else 0
+
+    def touch(self, trackid, lp=None, lr=None, requestcount=None):
+        """Updates the row of `trackid` after a play or request happened
+        in this process, does nothing if the track isn't known yet"""
+        with self.lock:
+            position = self.index.get(trackid)
+            if position is None:
+                return
+            if lp is not None:
+                self.lp[position] = lp
+            if lr is not None:
+                self.lr[position] = lr
+            if requestcount is not None:
+                self.requestcount[position] = requestcount
+
+    def positions(self, ids):
+        """Returns an array with the position of each id, -1 if unknown"""
+        with self.lock:
+            return numpy.array([self.index.get(int(trackid), -1)
+                                for trackid in ids], dtype=numpy.int64)
+
+    def waits(self, positions=None, now=None):
+        """Returns the seconds until the rows at `positions`, or all rows,
+        can be requested. 0 if they can be requested now"""
+        now = time.time() if now is None else now
+        with self.lock:
+            if positions is None:
+                positions = slice(None)
+            delay = songdelays(self.requestcount[positions])
+            last = numpy.maximum(self.lp[positions], self.lr[positions])
+            return numpy.maximum(last + delay - now, 0)
+
+    def seconds_until_requestable(self, ids, now=None):
+        """Returns an array with the seconds until each track in `ids` can
+        be requested, 0 if it can be requested now. Unusable and unknown
+        tracks get infinity"""
+        self.check()
+        positions = self.positions(ids)
+        result = numpy.empty(len(positions), dtype=numpy.float64)
+        result.fill(numpy.inf)
+        known = positions >= 0
+        with self.lock:
+            waits = self.waits(positions[known], now).astype(numpy.float64)
+            waits[~self.usable[positions[known]]] = numpy.inf
+        result[known] = waits
+        return result
+
+    def requestable(self, ids, now=None):
+        """Returns a boolean array telling if each track in `ids` can be
+        requested right now"""
+        return self.seconds_until_requestable(ids, now) == 0
+
+    def filter(self, ids, now=None):
+        """Returns the ids in `ids` that can be requested right now, in the
+        same order"""
+        ids = list(ids)
+        mask = self.requestable(ids, now)
+        return [trackid for trackid, ok in zip(ids, mask) if ok]
+
+    def random(self, requestable=False, weight=None):
+        """Returns the id of a random usable track, or None if there is none.
+
+        requestable: only return tracks that can be requested right now
+        weight: None to pick uniformly, or 'requestcount' or 'priority' to
+            prefer tracks with a higher value in that column
+        """
+        self.check()
+        with self.lock:
+            mask = self.usable.copy()
+            if requestable:
+                mask &= self.waits() == 0
+            candidates = numpy.flatnonzero(mask)
+            if not len(candidates):
+                return None
+            if weight is None:
+                position = candidates[numpy.random.randint(len(candidates))]
+            else:
+                # Everything gets a weight of at least 1
+                weights = getattr(self, weight)[candidates] + 1
+                cumulative = numpy.cumsum(weights)
+                target = numpy.random.random_sample() * cumulative[-1]
+                position = candidates[numpy.searchsorted(cumulative, target,
+                                                         side="right")]
+            return int(self.ids[position])
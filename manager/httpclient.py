@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+import time
+import logging
+import threading
+import urlparse
+
+import requests
+import requests.adapters
+
+import bootstrap
+
+
+class HTTPClient(object):
+    """Shared HTTP client for every outgoing request.
+
+    Requests are made on one keep-alive session per host, so connections
+    are reused instead of doing a new handshake every time. Every request
+    gets a timeout of `timeout` seconds unless one is given, and its
+    latency is recorded under an endpoint name, the host and path of the
+    url by default. See `stats`.
+    """
+    __metaclass__ = bootstrap.Singleton
+    timeout = 5
+    # Connections kept open per host
+    pool_size = 10
+
+    def __init__(self):
+        super(HTTPClient, self).__init__()
+        self.lock = threading.Lock()
+        self.sessions = {}
+        # endpoint -> [requests, errors, total seconds, max seconds]
+        self.metrics = {}
+
+    def session(self, url):
+        """Returns the session for the host of `url`"""
+        parts = urlparse.urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        with self.lock:
+            session = self.sessions.get(host)
+            if (session is None):
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(parts.scheme + "://", adapter)
+                self.sessions[host] = session
+            return session
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """Does a request like `requests.request`, on the session of the
+        host of `url`"""
+        if (endpoint is None):
+            parts = urlparse.urlsplit(url)
+            endpoint = parts.netloc + parts.path
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.time()
+        failed = True
+        try:
+            response = self.session(url).request(method, url, **kwargs)
+            failed = False
+            return response
+        finally:
+            self.record(endpoint, time.time() - start, failed)
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def record(self, endpoint, duration, failed):
+        with self.lock:
+            metrics = self.metrics.setdefault(endpoint, [0, 0, 0.0, 0.0])
+            metrics[0] += 1
+            metrics[1] += failed
+            metrics[2] += duration
+            metrics[3] = max(metrics[3], duration)
+        if (failed):
+            logging.debug("HTTP request to %s failed after %.2f seconds",
+                          endpoint, duration)
+
+    def stats(self):
+        """Returns a dict of endpoint -> dict with the amount of requests
+        and errors and the average and maximum latency in seconds"""
+        with self.lock:
+            return dict((endpoint, {"requests": count,
+                                    "errors": errors,
+                                    "average": total / count,
+                                    "max": longest})
+                        for endpoint, (count, errors, total, longest)
+                        in self.metrics.iteritems())
@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+import time
+import logging
+import threading
+import collections
+
+from .httpclient import HTTPClient
+import bootstrap
+import config
+
+
+class IndexQueue(object):
+    """Background queue of search index updates.
+
+    Track ids put on the queue are pinged at `config.index_route` by a
+    worker thread over the keep-alive session of the HTTPClient, one
+    request per id as the route takes a single id. An id that is put again
+    while it is still pending is only sent once. Failed updates are
+    retried up to `retries` times, waiting `backoff` seconds doubled for
+    every attempt. Handlers added with `add_handler` are called with the
+    list of ids of every batch that got sent.
+    """
+    __metaclass__ = bootstrap.Singleton
+    retries = 5
+    backoff = 2
+    timeout = 5
+    # Log a warning when the oldest pending update is older than this
+    lag_warning = 60
+
+    def __init__(self):
+        super(IndexQueue, self).__init__()
+        self.condition = threading.Condition()
+        # trackid -> [time first queued, attempts, not before]
+        self.pending = collections.OrderedDict()
+        self._handlers = []
+        self.sent = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name="Search Index Updater")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, trackid):
+        """Queues an index update of `trackid`"""
+        with self.condition:
+            if (trackid not in self.pending):
+                self.pending[trackid] = [time.time(), 0, 0]
+                self.condition.notify()
+
+    def add_handler(self, handle):
+        """Adds a handler that gets called with a list of track ids every
+        time a batch of updates got sent"""
+        self._handlers.append(handle)
+
+    def lag(self):
+        """Returns the seconds the oldest pending update has been waiting"""
+        with self.condition:
+            if (not self.pending):
+                return 0
+            return time.time() - min(entry[0] for entry
+                                     in self.pending.itervalues())
+
+    def ready(self):
+        """Removes and returns the pending ids that can be sent now"""
+        now = time.time()
+        batch = [(trackid, entry) for trackid, entry
+                 in self.pending.iteritems() if entry[2] <= now]
+        for trackid, entry in batch:
+            del self.pending[trackid]
+        return batch
+
+    def run(self):
+        logging.info("THREADING: Started search index updater")
+        while True:
+            with self.condition:
+                batch = self.ready()
+                while not batch:
+                    if (self.pending):
+                        wait = min(entry[2] for entry
+                                   in self.pending.itervalues()) - time.time()
+                        self.condition.wait(max(wait, 0.1))
+                    else:
+                        self.condition.wait()
+                    batch = self.ready()
+            self.send(batch)
+
+    def send(self, batch):
+        """Sends the updates of `batch`, a list of (trackid, entry) tuples,
+        and requeues the failed ones"""
+        done = []
+        for trackid, entry in batch:
+            try:
+                response = HTTPClient().get(
+                    config.index_route.format(trackid), endpoint="index",
+                    auth=(config.index_user, config.index_pass),
+                    timeout=self.timeout)
+                response.raise_for_status()
+            except:
+                entry[1] += 1
+                if (entry[1] >= self.retries):
+                    self.failed += 1
+                    logging.warning("Giving up on index update of %d", trackid)
+                    continue
+                entry[2] = time.time() + self.backoff * 2 ** (entry[1] - 1)
+                with self.condition:
+                    # A fresh put of the same id replaces the retry
+                    self.pending.setdefault(trackid, entry)
+            else:
+                self.sent += 1
+                done.append(trackid)
+
+        lag = self.lag()
+        if (lag > self.lag_warning):
+            logging.warning("Search index updates are %d seconds behind", lag)
+
+        if (done):
+            for handle in self._handlers:
+                try:
+                    handle(done)
+                except:
+                    logging.exception("Index handler failed")
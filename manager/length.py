@@ -0,0 +1,186 @@
+from __future__ import absolute_import
+import os
+import time
+import logging
+import threading
+
+import mutagen
+
+from .util import MySQLNormalCursor
+from .writer import Batch, Writer
+import bootstrap
+import config
+
+
+class LengthIndex(object):
+    """Lengths of tracks, keyed by track id and the mtime of the file.
+
+    The lengths are kept in the `tracklength` table and loaded into memory
+    on first use, so getting the length of a track never has to open the
+    audio file unless it wasn't probed yet or its mtime changed since. The
+    prober thread started with `start_prober` fills the table in the
+    background and probes changed files again. Ids that aren't in the
+    table are remembered until the next reload, so they don't cost a query
+    every time.
+    """
+    __metaclass__ = bootstrap.Singleton
+    reload = 3600
+    # Rows written per batch by the prober
+    batch_size = 100
+
+    def __init__(self):
+        super(LengthIndex, self).__init__()
+        self.lock = threading.Lock()
+        self.lengths = {}
+        # Track ids known not to be in the table
+        self.missing = set()
+        self.loaded = 0
+
+    @staticmethod
+    def create_table():
+        with MySQLNormalCursor() as cur:
+            cur.execute("CREATE TABLE IF NOT EXISTS `tracklength` ( \
+            `id` INT UNSIGNED NOT NULL PRIMARY KEY, \
+            `mtime` INT UNSIGNED NOT NULL, \
+            `len` FLOAT NOT NULL);")
+
+    def check(self):
+        """Loads the table into memory if it is due, a failure is logged
+        and tried again a minute later"""
+        if time.time() - self.loaded < self.reload:
+            return
+        try:
+            self.create_table()
+            with MySQLNormalCursor() as cur:
+                cur.execute("SELECT id, mtime, len FROM `tracklength`;")
+                lengths = dict((trackid, (mtime, length))
+                               for trackid, mtime, length in cur)
+        except:
+            logging.exception("Loading the track length index failed")
+            self.loaded = time.time() - self.reload + 60
+            return
+        with self.lock:
+            self.lengths = lengths
+            self.missing = set()
+            self.loaded = time.time()
+
+    def get(self, trackid, filename=None):
+        """Returns the length of `trackid` in seconds or None if unknown.
+        When `filename` is given None is also returned if the file changed
+        since it was probed"""
+        self.check()
+        with self.lock:
+            entry = self.lengths.get(trackid)
+            missing = trackid in self.missing
+        if entry is None and not missing:
+            # Might have been probed by another process since we loaded
+            try:
+                with MySQLNormalCursor() as cur:
+                    cur.execute("SELECT mtime, len FROM `tracklength` \
+                    WHERE id=%s;", (trackid,))
+                    entry = cur.fetchone()
+            except:
+                logging.exception("Track length lookup of %d failed", trackid)
+                return None
+            with self.lock:
+                if entry is None:
+                    self.missing.add(trackid)
+                else:
+                    self.lengths[trackid] = entry
+        if entry is None:
+            return None
+        if filename is not None:
+            try:
+                if int(os.path.getmtime(filename)) != entry[0]:
+                    return None
+            except OSError:
+                pass
+        return entry[1]
+
+    def store(self, trackid, filename, length, batch=None):
+        """Stores `length` for `trackid` with the current mtime of
+        `filename`. The write is queued on the Writer unless a batch is
+        given"""
+        try:
+            mtime = int(os.path.getmtime(filename))
+        except OSError:
+            return
+        with self.lock:
+            self.lengths[trackid] = (mtime, length)
+            self.missing.discard(trackid)
+        submit = batch is None
+        batch = Batch() if batch is None else batch
+        batch.execute("INSERT INTO `tracklength` (id, mtime, len) \
+        VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE mtime=%s, len=%s;",
+                      (trackid, mtime, length, mtime, length))
+        if submit:
+            Writer().submit(batch)
+
+    @staticmethod
+    def probe(filename):
+        """Returns the length of the audio file `filename` in seconds"""
+        return mutagen.File(filename).info.length
+
+    def probe_all(self, event=None):
+        """Probes every track that isn't in the index yet or whose file
+        changed since. Stops early when `event` gets set"""
+        self.check()
+        with MySQLNormalCursor() as cur:
+            cur.execute("SELECT id, path FROM `tracks`;")
+            tracks = cur.fetchall()
+        batch = Batch()
+        probed = 0
+        for trackid, path in tracks:
+            if event is not None and event.is_set():
+                break
+            filename = os.path.join(config.music_directory, path)
+            try:
+                mtime = int(os.path.getmtime(filename))
+            except OSError:
+                continue
+            with self.lock:
+                entry = self.lengths.get(trackid)
+            if entry is not None and entry[0] == mtime:
+                continue
+            try:
+                length = self.probe(filename)
+            except:
+                logging.warning("Length probe of %d (%s) failed",
+                                trackid, filename)
+                continue
+            self.store(trackid, filename, length, batch)
+            probed += 1
+            if len(batch) >= self.batch_size:
+                Writer().submit(batch)
+                batch = Batch()
+        Writer().submit(batch)
+        if probed:
+            logging.info("Probed the length of %d tracks", probed)
+
+
+def start_prober(interval=3600):
+    """Starts a thread that runs LengthIndex.probe_all every `interval`
+    seconds"""
+    global prober_event, prober_thread
+    prober_event = threading.Event()
+
+    def prober():
+        logging.info("THREADING: Starting track length prober")
+        while not prober_event.is_set():
+            try:
+                LengthIndex().probe_all(prober_event)
+            except:
+                logging.exception("THREADING: track length prober "
+                                  "encountered an error")
+            prober_event.wait(interval)
+        logging.info("THREADING: Stopping track length prober")
+
+    prober_thread = threading.Thread(name="Track Length Prober",
+                                     target=prober)
+    prober_thread.daemon = 1
+    prober_thread.start()
+
+
+def stop_prober():
+    prober_event.set()
+    prober_thread.join(10)
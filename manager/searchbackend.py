@@ -0,0 +1,290 @@
+from __future__ import absolute_import
+import re
+import time
+import bisect
+import logging
+import threading
+import collections
+
+from .util import MySQLNormalCursor
+from .indexer import IndexQueue
+import bootstrap
+import config
+
+
+class SearchBackend(object):
+    """Interface of the search backends used by `manager.util.search`.
+
+    `search` returns an iterable of dicts with at least the key "id", in
+    the order they should be shown. `update` is called with a list of track
+    ids every time their search index got updated.
+    """
+    def search(self, query, limit=5):
+        raise NotImplementedError
+
+    def update(self, ids):
+        pass
+
+
+class ElasticsearchBackend(SearchBackend):
+    """Searches the elasticsearch index filled by the site. The client is
+    only created on the first search"""
+    __metaclass__ = bootstrap.Singleton
+
+    def __init__(self):
+        super(ElasticsearchBackend, self).__init__()
+        self._client = None
+
+    @property
+    def client(self):
+        if (self._client is None):
+            import elasticsearch
+            self._client = elasticsearch.Elasticsearch(
+                config.elasticsearch_server)
+        return self._client
+
+    def search(self, query, limit=5):
+        query = {
+           "query": {
+               "match": {
+                    "_all": {
+                        "query": query,
+                        "operator": "and",
+                    }
+                },
+            },
+            "from": 0, "size": limit,
+            "sort": [
+                { "requests": { "order": "desc", "ignore_unmapped": True }},
+                { "_score": { "order": "desc" }}
+            ]
+        }
+
+        res = self.client.search(config.elasticsearch_index, body=query)
+
+        return (item['_source'] for item in res['hits']['hits'])
+
+
+def tokenize(text):
+    """Returns the lowercased words in `text`"""
+    if (isinstance(text, str)):
+        text = text.decode("utf-8", "replace")
+    return re.findall(r"\w+", (text or u"").lower(), re.UNICODE)
+
+
+def trigrams(token):
+    """Returns the set of trigrams of `token`, padded at the start so short
+    tokens still get some"""
+    padded = u"  " + token
+    return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+
+class LocalBackend(SearchBackend):
+    """In-process inverted index over artist, title, album and tags of
+    `tracks`.
+
+    A query matches a track when every word of it matches a word of the
+    track, either exactly, as a prefix or, for words of four or more
+    letters, by sharing at least `similarity` of their trigrams. Results
+    are ranked by requestcount and then by how well they matched, like the
+    elasticsearch query. The index is built on the first search, rows are
+    read again when their index update fires and everything is rebuilt
+    every `reload` seconds.
+    """
+    __metaclass__ = bootstrap.Singleton
+    reload = 3600
+    similarity = 0.5
+    # Score of a word match of each kind
+    exact, prefix, fuzzy = 3, 2, 1
+    query = "SELECT id, artist, track, album, tags, requestcount FROM tracks"
+
+    def __init__(self):
+        super(LocalBackend, self).__init__()
+        self.lock = threading.RLock()
+        self.loaded = 0
+        self.clear()
+        IndexQueue().add_handler(self.update)
+
+    def clear(self):
+        # trackid -> document dict
+        self.documents = {}
+        # token -> set of trackids
+        self.postings = collections.defaultdict(set)
+        # trigram -> set of tokens
+        self.grams = collections.defaultdict(set)
+        # sorted list of all tokens, for prefix lookups
+        self.tokens = []
+
+    def check(self):
+        """Rebuilds the index if it is due"""
+        with self.lock:
+            if time.time() - self.loaded > self.reload:
+                self.load()
+
+    def load(self):
+        with MySQLNormalCursor() as cur:
+            cur.execute(self.query + ";")
+            rows = cur.fetchall()
+        with self.lock:
+            self.clear()
+            for row in rows:
+                self.add(*row)
+            self.tokens.sort()
+            self.loaded = time.time()
+        logging.info("Indexed %d tracks for searching", len(rows))
+
+    def update(self, ids):
+        """Reads the rows of `ids` again"""
+        if (not self.loaded or not ids):
+            return
+        with MySQLNormalCursor() as cur:
+            cur.execute(self.query + " WHERE id IN ({0});".format(
+                ", ".join(["%s"] * len(ids))), tuple(ids))
+            rows = cur.fetchall()
+        with self.lock:
+            for trackid in ids:
+                self.remove(trackid)
+            for row in rows:
+                self.add(*row, insort=True)
+
+    def add(self, trackid, artist, title, album, tags, requestcount,
+            insort=False):
+        tokens = set()
+        for text in (artist, title, album, tags):
+            tokens.update(tokenize(text))
+        self.documents[trackid] = {"id": trackid, "artist": artist,
+                                   "title": title, "album": album,
+                                   "tags": tags, "requests": requestcount or 0,
+                                   "tokens": tokens}
+        for token in tokens:
+            if (token not in self.postings):
+                for gram in trigrams(token):
+                    self.grams[gram].add(token)
+                if (insort):
+                    bisect.insort(self.tokens, token)
+                else:
+                    self.tokens.append(token)
+            self.postings[token].add(trackid)
+
+    def remove(self, trackid):
+        document = self.documents.pop(trackid, None)
+        if (document is None):
+            return
+        # Tokens without postings are left in place until the next reload
+        for token in document["tokens"]:
+            self.postings[token].discard(trackid)
+
+    def match(self, word):
+        """Returns a dict of trackid -> score for tracks matching `word`"""
+        scores = {}
+
+        def score(token, value):
+            for trackid in self.postings.get(token, ()):
+                if (scores.get(trackid, 0) < value):
+                    scores[trackid] = value
+
+        start = bisect.bisect_left(self.tokens, word)
+        for position in xrange(start, len(self.tokens)):
+            token = self.tokens[position]
+            if (not token.startswith(word)):
+                break
+            score(token, self.exact if token == word else self.prefix)
+
+        if (len(word) >= 4):
+            wanted = trigrams(word)
+            counts = collections.Counter()
+            for gram in wanted:
+                counts.update(self.grams.get(gram, ()))
+            for token, count in counts.iteritems():
+                if (float(count) / len(wanted | trigrams(token))
+                        >= self.similarity):
+                    score(token, self.fuzzy)
+        return scores
+
+    def search(self, query, limit=5):
+        self.check()
+        words = tokenize(query)
+        if (not words):
+            return []
+        with self.lock:
+            scores = None
+            for word in set(words):
+                matches = self.match(word)
+                if (scores is None):
+                    scores = matches
+                else:
+                    scores = dict((trackid, value + matches[trackid])
+                                  for trackid, value in scores.iteritems()
+                                  if trackid in matches)
+                if (not scores):
+                    return []
+            ranked = sorted(scores.iteritems(), key=lambda (trackid, value):
+                            (-self.documents[trackid]["requests"], -value))
+            return [dict((key, value) for key, value
+                         in self.documents[trackid].iteritems()
+                         if key != "tokens")
+                    for trackid, value in ranked[:limit]]
+
+
+class SearchCache(object):
+    """LRU cache of search results, keyed by the normalized query.
+
+    Results are kept for `timeout` seconds and at most `size` queries are
+    cached. Results containing a track are dropped when the index update
+    of that track fires in this process. Every process has its own cache
+    and updates made by another process aren't seen here, so results can
+    be stale for up to `timeout` seconds.
+    """
+    __metaclass__ = bootstrap.Singleton
+    size = 1000
+    timeout = 30
+
+    def __init__(self):
+        super(SearchCache, self).__init__()
+        self.lock = threading.Lock()
+        # (query, limit) -> (expire, results)
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        IndexQueue().add_handler(self.invalidate)
+
+    @staticmethod
+    def normalize(query):
+        return u" ".join(tokenize(query))
+
+    def get(self, query, limit):
+        """Returns the cached results or None"""
+        key = (self.normalize(query), limit)
+        with self.lock:
+            entry = self.results.pop(key, None)
+            if (entry is None or entry[0] < time.time()):
+                self.misses += 1
+                return None
+            self.results[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query, limit, results):
+        key = (self.normalize(query), limit)
+        with self.lock:
+            self.results.pop(key, None)
+            self.results[key] = (time.time() + self.timeout, results)
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+    def invalidate(self, ids):
+        """Drops the results that contain any of `ids`"""
+        ids = set(ids)
+        with self.lock:
+            for key, (expire, results) in self.results.items():
+                if (any(item["id"] in ids for item in results)):
+                    del self.results[key]
+
+
+backends = {"elasticsearch": ElasticsearchBackend,
+            "local": LocalBackend}
+
+
+def get_backend():
+    """Returns the search backend named by `config.search_backend`"""
+    return backends[getattr(config, "search_backend", "elasticsearch")]()
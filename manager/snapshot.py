@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+import os
+import time
+import copy
+import logging
+import threading
+
+from util import BaseManager
+import bootstrap
+import config
+
+
+class StatusSnapshot(object):
+    """The last stream status fetched by the status poller.
+
+    The version is bumped every time a published status differs from the
+    previous one. Other processes read the snapshot through StatusManager
+    and can block in `wait` until the version changes.
+    """
+    __metaclass__ = bootstrap.Singleton
+
+    def __init__(self):
+        super(StatusSnapshot, self).__init__()
+        self.condition = threading.Condition()
+        self.version = 0
+        self.status = {"online": False}
+        self.updated = 0
+
+    def publish(self, status):
+        """Replaces the snapshot with `status`, returns True if it changed"""
+        with self.condition:
+            self.updated = time.time()
+            if (status == self.status):
+                return False
+            self.status = copy.deepcopy(status)
+            self.version += 1
+            self.condition.notify_all()
+            return True
+
+    def get(self):
+        """Returns a (version, updated, status) tuple"""
+        with self.condition:
+            return (self.version, self.updated, self.status)
+
+    def wait(self, version, timeout=30):
+        """Waits at most `timeout` seconds for a snapshot newer than
+        `version`, and returns it like `get` either way"""
+        with self.condition:
+            end = time.time() + timeout
+            while self.version == version and time.time() < end:
+                self.condition.wait(end - time.time())
+            return (self.version, self.updated, self.status)
+
+
+class StatusManager(BaseManager):
+    socket = getattr(config, "manager_status", "/tmp/hanyuu_status")
+
+StatusManager.register("snapshot", StatusSnapshot)
+
+
+def serve_snapshot():
+    """Starts a thread that serves StatusSnapshot to other processes"""
+    try:
+        os.remove(StatusManager.socket)
+    except OSError:
+        pass
+
+    def serve():
+        logging.info("THREADING: Starting status snapshot server")
+        try:
+            StatusManager.start_server()
+        except:
+            logging.exception("THREADING: status snapshot server stopped")
+
+    thread = threading.Thread(name="Status Snapshot Server", target=serve)
+    thread.daemon = 1
+    thread.start()
+    return thread
+
+
+def connect_snapshot():
+    """Returns a proxy of the StatusSnapshot served by another process"""
+    return StatusManager.connect_to().snapshot()
@@ -1,14 +1,278 @@
 from __future__ import absolute_import
 import time
+import random
 import logging
+import collections
 
 import mutagen
 
-from .util import MySQLNormalCursor, MySQLCursor, unix_to_text, search
+from .util import MySQLNormalCursor, MySQLCursor, MySQLStreamCursor, \
+    unix_to_text, search, songdelay
+from .length import LengthIndex
+from .indexer import IndexQueue
 import config
 
 
+class SongStats(collections.namedtuple("SongStats", ("favecount",
+                                                     "playcount",
+                                                     "lp",
+                                                     "lr",
+                                                     "requestcount"))):
+    """Snapshot of the statistics of a song, as returned by Song.stats"""
+    __slots__ = ()
+
+    @property
+    def lpf(self):
+        """Same as Song.lpf but without touching the database"""
+        return unix_to_text(0 if self.lp is None else self.lp)
+
+    @property
+    def lrf(self):
+        """Same as Song.lrf but without touching the database"""
+        return unix_to_text(0 if self.lr is None else self.lr)
+
+
+# Song.stats cache, maps a digest to a tuple of (expire time, SongStats)
+_stats_cache = {}
+_stats_cache_size = 1000
+
+# Song.get_songid cache, maps a digest to esong.id
+_songid_cache = {}
+
+# get_nickids cache, maps a nickname to enick.id
+_nickid_cache = {}
+
+# (table, column) -> whether it has a UNIQUE index, which the upserts in
+# this module rely on. Checked once per process, the indexes are added by
+# the scripts in migrations/
+unique_indexes = {("esong", "hash"): None, ("enick", "nick"): None}
+
+
+def has_unique_index(table, column):
+    """Returns True if `table`.`column` has a UNIQUE index"""
+    if (unique_indexes.get((table, column)) is None):
+        with MySQLCursor() as cur:
+            cur.execute("SHOW INDEX FROM `{table}` WHERE `Column_name`=%s \
+                AND `Non_unique`=0 AND `Seq_in_index`=1;".format(table=table),
+                        (column,))
+            unique_indexes[(table, column)] = cur.rowcount > 0
+        if (not unique_indexes[(table, column)]):
+            logging.error("%s.%s has no UNIQUE index, run the migration in "
+                          "migrations/ that adds it. Inserts into %s are "
+                          "not safe against concurrent inserts until then",
+                          table, column, table)
+    return unique_indexes[(table, column)]
+
+
+def check_unique_columns():
+    """Checks the UNIQUE indexes in `unique_indexes`, logs an error for
+    every missing one. Returns False if one is missing"""
+    return all([has_unique_index(table, column)
+                for table, column in unique_indexes])
+
+
+def get_nickids(nicks):
+    """Returns a dict of nick to enick.id for all of `nicks`, creating the
+    nicknames that don't exist yet. Ids are cached in-process"""
+    missing = [nick for nick in set(nicks) if nick not in _nickid_cache]
+    if (missing):
+        # Without the index INSERT IGNORE would add duplicate nicknames,
+        # so only the ones that aren't found are inserted
+        insert = "INSERT IGNORE" if has_unique_index("enick", "nick") \
+            else "INSERT"
+        with MySQLNormalCursor() as cur:
+            found = select_nickids(cur, missing)
+            new = [nick for nick in missing if nick.lower() not in found]
+            if (new):
+                cur.execute("{insert} INTO enick (`nick`) VALUES {values};"
+                            .format(insert=insert,
+                                    values=", ".join(["(%s)"] * len(new))),
+                            new)
+                found.update(select_nickids(cur, new))
+        for nick in missing:
+            nickid = found.get(nick.lower())
+            if (nickid is not None):
+                _nickid_cache[nick] = nickid
+    return dict((nick, _nickid_cache[nick]) for nick in nicks
+                if nick in _nickid_cache)
+
+
+def select_nickids(cur, nicks):
+    """Returns a dict of lowercased nick to enick.id of the `nicks` that
+    exist, the oldest row wins for a nickname that exists more than once.
+    enick.nick compares case insensitive, so the casing might differ"""
+    cur.execute("SELECT nick, id FROM enick WHERE nick IN ({nicks}) \
+    ORDER BY id;".format(nicks=", ".join(["%s"] * len(nicks))), nicks)
+    found = {}
+    for nick, nickid in cur:
+        found.setdefault(nick.lower(), nickid)
+    return found
+
+
+class Faves(object):
+    """List-like object of the nicknames that favorited a song.
+
+    The nicknames are loaded once on first use and kept in memory, changes
+    are written to the database straight away with one statement per
+    operation no matter how many nicknames are involved. Nicknames are
+    compared case insensitive like the database does.
+    """
+    # Maximum amount of rows in a single INSERT or DELETE
+    chunk_size = 500
+
+    def __init__(self, song):
+        self.song = song
+        self._nicks = None
+
+    @property
+    def nicks(self):
+        """Dict of lowercased nickname to nickname, loaded on first use"""
+        if (self._nicks is None):
+            with MySQLNormalCursor() as cur:
+                cur.execute("SELECT enick.nick FROM efave JOIN enick ON \
+                efave.inick = enick.id WHERE efave.isong = %s;",
+                            (self.song.songid,))
+                self._nicks = dict((nick.lower(), nick) for nick, in cur)
+        return self._nicks
+
+    def reload(self):
+        """Drops the cached nicknames, the next use loads them again"""
+        self._nicks = None
+
+    def transfer(self, other_song):
+        """Transfers faves from `self` to `other_song`"""
+        nicks = list(self)
+        other_song.faves.extend(nicks)
+        self._delete(nicks)
+
+    def index(self, key):
+        """Same as a normal list"""
+        return list(self).index(key)
+
+    def count(self, key):
+        """returns 1 if nick exists else 0, use "key in faves" instead
+        of faves.count(key)"""
+        if (key in self):
+            return 1
+        return 0
+
+    def remove(self, key):
+        """Removes 'key' from the favorites"""
+        self.__delitem__(key)
+
+    def pop(self, index):
+        """Not implemented"""
+        raise NotImplementedError("No popping allowed")
+
+    def insert(self, index, value):
+        """Not implemented"""
+        raise NotImplementedError("No inserting allowed, use append")
+
+    def sort(self, cmp, key, reverse):
+        """Not implemented"""
+        raise NotImplementedError(
+            "Sorting now allowed, use reverse(faves) or list(faves)")
+
+    def append(self, nick):
+        """Add a nickname to the favorites of this song, handles
+        creation of nicknames in the database. Does nothing if
+        nick is already in the favorites"""
+        self.extend([nick])
+
+    def extend(self, seq):
+        """Same as 'append' but allows multiple nicknames to be added
+        by suppling a list of nicknames"""
+        new = {}
+        for nick in seq:
+            if (nick.lower() not in self.nicks):
+                new.setdefault(nick.lower(), nick)
+        if (not new):
+            return
+        nickids = get_nickids(new.values())
+        rows = [(nickids[nick], self.song.songid) for nick in new.values()
+                if nick in nickids]
+        with MySQLCursor() as cur:
+            for i in xrange(0, len(rows), self.chunk_size):
+                chunk = rows[i:i + self.chunk_size]
+                cur.execute("INSERT INTO efave (`inick`, `isong`) VALUES \
+                {values};".format(values=", ".join(["(%s, %s)"] * len(chunk))),
+                            [value for row in chunk for value in row])
+            if (self.song.id != 0):
+                cur.execute("UPDATE `tracks` SET `priority`=priority+%s \
+                WHERE `id`=%s;", (2 * len(rows), self.song.id))
+        self.nicks.update((nick.lower(), nick) for nick in new.itervalues()
+                          if nick in nickids)
+        Song.invalidate_stats(self.song.digest)
+
+    def _delete(self, nicks):
+        """Removes all of `nicks` from the favorites in one go"""
+        nicks = [self.nicks[nick.lower()] for nick in nicks
+                 if nick.lower() in self.nicks]
+        if (not nicks):
+            return
+        # Joined by nickname, so the faves of every enick row of a nickname
+        # go even if it exists more than once
+        with MySQLCursor() as cur:
+            for i in xrange(0, len(nicks), self.chunk_size):
+                chunk = nicks[i:i + self.chunk_size]
+                cur.execute("DELETE efave FROM efave JOIN enick ON \
+                efave.inick = enick.id WHERE efave.isong=%s AND enick.nick \
+                IN ({nicks});".format(nicks=", ".join(["%s"] * len(chunk))),
+                            [self.song.songid] + chunk)
+        for nick in nicks:
+            self.nicks.pop(nick.lower(), None)
+        Song.invalidate_stats(self.song.digest)
+
+    def __iter__(self):
+        """Returns an iterator over the favorite list, sorted
+        alphabetical. Use list(faves) to generate a list copy of the
+        nicknames"""
+        return iter(sorted(self.nicks.itervalues(),
+                           key=lambda nick: nick.lower()))
+
+    def __reversed__(self):
+        """Just here for fucks, does the normal as you expect"""
+        return iter(sorted(self.nicks.itervalues(),
+                           key=lambda nick: nick.lower(), reverse=True))
+
+    def __len__(self):
+        """len(faves) is efficient"""
+        return len(self.nicks)
+
+    def __getitem__(self, key):
+        return list(self)[key]
+
+    def __setitem__(self, key, value):
+        """Not implemented"""
+        raise NotImplementedError("Can't set on <Faves> object")
+
+    def __delitem__(self, key):
+        if (isinstance(key, basestring)):
+            # Nick delete
+            if (key in self):
+                # It is in there
+                self._delete([key])
+            else:
+                raise KeyError("{0}".format(key))
+        else:
+            raise TypeError("Fave key has to be 'string'")
+
+    def __contains__(self, key):
+        if not isinstance(key, basestring):
+            return False
+        return key.lower() in self.nicks
+
+    def __repr__(self):
+        return (u"Favorites of {song}".format(song=repr(self.song).decode('utf-8'))).encode('utf-8')
+
+    def __str__(self):
+        return self.__repr__()
+
+
 class Song(object):
+    # Seconds a stats snapshot is valid for when the song isn't playing
+    stats_timeout = 60
+
     def __init__(self, id=None, meta=None, length=None, filename=None):
         super(Song, self).__init__()
         if (not isinstance(id, (int, long, type(None)))):
@@ -29,7 +293,7 @@ class Song(object):
         self._faves = None
         if (meta is None) and (self.id == 0):
             raise TypeError("Require either 'id' or 'meta' argument")
-        elif (self.id != 0):
+        elif (self.id != 0) and (meta is None or filename is None):
             temp_filename, temp_meta = self.get_file(self.id)
             if (temp_filename is None) and (temp_meta is None):
                 # No track with that ID sir
@@ -41,7 +305,7 @@ class Song(object):
         self._filename = filename
         self._metadata = self.fix_encoding(meta)
 
-    def update(self, **kwargs):
+    def update(self, batch=None, **kwargs):
         """Gives you the possibility to update the
             'lp', 'id', 'length', 'filename' and 'metadata'
             variables in the Song instance
@@ -49,6 +313,9 @@ class Song(object):
             Updating the 'lp' and 'length' will directly affect the database
             while 'filename', 'metadata' and 'id' don't, updating 'id' also
             updates 'filename' but not 'metadata'
+
+            When a writer.Batch is passed as 'batch' the database changes
+            are added to it instead of being executed
             """
         if (self.metadata == u'') and (kwargs.get("metadata", u"") == u""):
             return
@@ -57,7 +324,7 @@ class Song(object):
                 if (key == "metadata"):
                     value = self.fix_encoding(value)
                 setattr(self, "_" + key, value)
-                with MySQLCursor() as cur:
+                with (MySQLCursor() if batch is None else batch) as cur:
                     if (key == "lp"):
                         # change database entries for LP data
                         cur.execute("INSERT INTO eplay (`isong`, `dt`) \
@@ -189,12 +456,7 @@ class Song(object):
             for rc, in cur:
                 break
 
-        import math
-        rc = min(rc, 30)
-
-        if 0 <= rc <= 7:
-            return -11057 * rc ** 2 + 172954 * rc + 81720
-        return int(599955 * math.exp(0.0372 * rc) + 0.5)
+        return songdelay(rc)
 
     @property
     def requestable(self):
@@ -217,6 +479,60 @@ class Song(object):
             return False  # the song delay has not passed for lr
         return True
 
+    def stats(self, refresh=False):
+        """Returns a SongStats snapshot with the favecount, playcount,
+        last played, last requested and requestcount of this song.
+
+        All values are retrieved with a single query and cached until
+        `stats_expire` has passed, use refresh=True to force a new query.
+        """
+        cached = _stats_cache.get(self.digest)
+        if (not refresh) and cached and cached[0] > time.time():
+            return cached[1]
+
+        with MySQLCursor() as cur:
+            cur.execute("SELECT \
+            (SELECT count(*) FROM efave JOIN esong ON efave.isong = esong.id \
+            WHERE esong.hash = %(digest)s) AS favecount, \
+            (SELECT count(*) FROM eplay JOIN esong ON eplay.isong = esong.id \
+            WHERE esong.hash = %(digest)s) AS playcount, \
+            (SELECT unix_timestamp(max(eplay.dt)) FROM eplay JOIN esong ON \
+            eplay.isong = esong.id WHERE esong.hash = %(digest)s) AS lp, \
+            (SELECT unix_timestamp(lastrequested) FROM tracks \
+            WHERE id = %(id)s) AS lr, \
+            (SELECT requestcount FROM tracks WHERE id = %(id)s) \
+            AS requestcount;", {"digest": self.digest, "id": self.id})
+            row = cur.fetchone()
+        stats = SongStats(favecount=row['favecount'] or 0,
+                          playcount=row['playcount'] or 0,
+                          lp=row['lp'],
+                          lr=row['lr'],
+                          requestcount=row['requestcount'] or 0)
+        if (len(_stats_cache) >= _stats_cache_size):
+            # Drop the expired snapshots, or everything if none expired
+            now = time.time()
+            for digest, (expire, cached) in _stats_cache.items():
+                if (expire <= now):
+                    del _stats_cache[digest]
+            if (len(_stats_cache) >= _stats_cache_size):
+                _stats_cache.clear()
+        _stats_cache[self.digest] = (self.stats_expire, stats)
+        return stats
+
+    @property
+    def stats_expire(self):
+        """Unixtime until which a stats snapshot of this song is used"""
+        return time.time() + self.stats_timeout
+
+    @staticmethod
+    def invalidate_stats(digest=None):
+        """Drops the cached stats snapshot of `digest`, or all of them when
+        no digest is given"""
+        if (digest is None):
+            _stats_cache.clear()
+        else:
+            _stats_cache.pop(digest, None)
+
     @property
     def favecount(self):
         """Returns the amount of favorites on this song as integer,
@@ -227,167 +543,8 @@ class Song(object):
     def faves(self):
         """Returns a Faves instance, list-like object that allows editing of
         the favorites of this song"""
-        class Faves(object):
-
-            def __init__(self, song):
-                self.song = song
-
-            def transfer(self, other_song):
-                """Transfers faves from `self` to `other_song`"""
-                other_song.faves.extend(self)
-                for fave in self:
-                    self.remove(fave)
-
-            def index(self, key):
-                """Same as a normal list, very inefficient shouldn't be used"""
-                return list(self).index(key)
-
-            def count(self, key):
-                """returns 1 if nick exists else 0, use "key in faves" instead
-                of faves.count(key)"""
-                if (key in self):
-                    return 1
-                return 0
-
-            def remove(self, key):
-                """Removes 'key' from the favorites"""
-                self.__delitem__(key)
-
-            def pop(self, index):
-                """Not implemented"""
-                raise NotImplementedError("No popping allowed")
-
-            def insert(self, index, value):
-                """Not implemented"""
-                raise NotImplementedError("No inserting allowed, use append")
-
-            def sort(self, cmp, key, reverse):
-                """Not implemented"""
-                raise NotImplementedError(
-                    "Sorting now allowed, use reverse(faves) or list(faves)")
-
-            def append(self, nick):
-                """Add a nickname to the favorites of this song, handles
-                creation of nicknames in the database. Does nothing if
-                nick is already in the favorites"""
-                if (nick in self):
-                    return
-                with MySQLCursor() as cur:
-                    cur.execute("SELECT * FROM enick WHERE nick=%s;",
-                                (nick,))
-                    if (cur.rowcount == 0):
-                        cur.execute("INSERT INTO enick (`nick`) VALUES(%s);",
-                                    (nick,))
-                        cur.execute("SELECT * FROM enick WHERE nick=%s;",
-                                    (nick,))
-                        nickid = cur.fetchone()['id']
-                        cur.execute("INSERT INTO efave (`inick`, `isong`) \
-                        VALUES(%s, %s);", (nickid, self.song.songid))
-                    elif (cur.rowcount == 1):
-                        nickid = cur.fetchone()['id']
-                        cur.execute("INSERT INTO efave (inick, isong) \
-                        VALUES(%s, %s);", (nickid, self.song.songid))
-                    if (self.song.id != 0):
-                        cur.execute("UPDATE `tracks` SET `priority`=priority+2\
-                         WHERE `id`=%s;", (self.song.id,))
-
-            def extend(self, seq):
-                """Same as 'append' but allows multiple nicknames to be added
-                by suppling a list of nicknames"""
-                original = list(self)
-                with MySQLCursor() as cur:
-                    for nick in seq:
-                        if (nick in original):
-                            continue
-                        original.append(nick)
-                        cur.execute("SELECT * FROM enick WHERE nick=%s;",
-                                   (nick,))
-                        if (cur.rowcount == 0):
-                            cur.execute(
-                                "INSERT INTO enick (`nick`) VALUES(%s);",
-                                (nick,))
-                            cur.execute("SELECT * FROM enick WHERE nick=%s;",
-                                        (nick,))
-                            nickid = cur.fetchone()['id']
-                            cur.execute("INSERT INTO efave (`inick`, `isong`) \
-                            VALUES(%s, %s);", (nickid, self.song.songid))
-                        elif (cur.rowcount == 1):
-                            nickid = cur.fetchone()['id']
-                            cur.execute("INSERT INTO efave (inick, isong) \
-                            VALUES(%s, %s);", (nickid, self.song.songid))
-                        if (self.song.id != 0):
-                            cur.execute("UPDATE `tracks` SET `priority`=\
-                            priority+2 WHERE `id`=%s;", (self.song.id,))
-
-            def __iter__(self):
-                """Returns an iterator over the favorite list, sorted
-                alphabetical. Use list(faves) to generate a list copy of the
-                nicknames"""
-                with MySQLCursor() as cur:
-                    cur.execute("SELECT enick.nick FROM esong JOIN efave ON \
-                    efave.isong = esong.id JOIN enick ON efave.inick = \
-                    enick.id WHERE esong.hash = '{digest}' ORDER BY enick.nick\
-                     ASC"
-                                .format(digest=self.song.digest))
-                    for result in cur:
-                        yield result['nick']
-
-            def __reversed__(self):
-                """Just here for fucks, does the normal as you expect"""
-                with MySQLCursor() as cur:
-                    cur.execute("SELECT enick.nick FROM esong JOIN efave ON \
-                    efave.isong = esong.id JOIN enick ON efave.inick = \
-                    enick.id WHERE esong.hash = '{digest}' ORDER BY enick.nick\
-                     DESC"
-                                .format(digest=self.song.digest))
-                    for result in cur:
-                        yield result['nick']
-
-            def __len__(self):
-                """len(faves) is efficient"""
-                with MySQLCursor() as cur:
-                    cur.execute("SELECT count(*) AS favecount FROM efave \
-                    WHERE isong={songid}".format(songid=self.song.songid))
-                    return cur.fetchone()['favecount']
-
-            def __getitem__(self, key):
-                return list(self)[key]
-
-            def __setitem__(self, key, value):
-                """Not implemented"""
-                raise NotImplementedError("Can't set on <Faves> object")
-
-            def __delitem__(self, key):
-                if (isinstance(key, basestring)):
-                    # Nick delete
-                    if (key in self):
-                        # It is in there
-                        with MySQLCursor() as cur:
-                            cur.execute(
-                                "DELETE efave.* FROM efave LEFT JOIN enick ON enick.id = efave.inick WHERE \
-        enick.nick=%s AND isong=%s;", (key, self.song.songid))
-                    else:
-                        raise KeyError("{0}".format(key))
-                else:
-                    raise TypeError("Fave key has to be 'string'")
-
-            def __contains__(self, key):
-                with MySQLCursor() as cur:
-                    cur.execute("SELECT count(*) AS contains FROM efave JOIN\
-                     enick ON enick.id = efave.inick WHERE enick.nick=%s \
-                     AND efave.isong=%s;",
-                                (key, self.song.songid))
-                    if (cur.fetchone()['contains'] > 0):
-                        return True
-                    return False
-
-            def __repr__(self):
-                return (u"Favorites of {song}".format(song=repr(self.song).decode('utf-8'))).encode('utf-8')
-
-            def __str__(self):
-                return self.__repr__()
-        if (not self._faves):
-            return Faves(self)
+        if (self._faves is None):
+            self._faves = Faves(self)
         return self._faves
 
     @property
@@ -410,12 +567,18 @@ class Song(object):
 
     @staticmethod
     def get_length(song):
+        if (song.id != 0):
+            length = LengthIndex().get(song.id, song.filename)
+            if (length is not None):
+                return length
         if (song.filename is not None):
             try:
                 length = mutagen.File(song.filename).info.length
             except (IOError, ValueError):
                 logging.exception("failed length check of %d (%s)", song.id, song.digest)
                 return 0.0
+            if (song.id != 0):
+                LengthIndex().store(song.id, song.filename, length)
             return length
 
         # try hash
@@ -448,17 +611,46 @@ class Song(object):
 
     @staticmethod
     def get_songid(song):
+        """Returns the esong.id of `song`, creating the row if needed"""
+        try:
+            return _songid_cache[song.digest]
+        except KeyError:
+            pass
+        upsert = has_unique_index("esong", "hash")
         with MySQLCursor() as cur:
-            cur.execute("SELECT * FROM `esong` WHERE `hash`=%s LIMIT 1;",
-                        (song.digest,))
+            cur.execute("SELECT `id` FROM `esong` WHERE `hash`=%s \
+            ORDER BY `id` LIMIT 1;", (song.digest,))
             if (cur.rowcount == 1):
-                return cur.fetchone()['id']
+                songid = cur.fetchone()['id']
+            elif (upsert):
+                # Another process can insert the same hash in between, the
+                # UNIQUE index turns that into an update and
+                # LAST_INSERT_ID(id) makes lastrowid return the existing row
+                cur.execute("INSERT INTO `esong` (`hash`, `len`, `meta`, \
+                `hash_link`) VALUES (%s, %s, %s, %s) ON DUPLICATE KEY \
+                UPDATE `id`=LAST_INSERT_ID(`id`);",
+                            (song.digest, song.length, song.metadata,
+                             song.digest))
+                songid = cur.lastrowid
             else:
-                cur.execute("INSERT INTO `esong` (`hash`, `len`, `meta`, `hash_link`) \
-                VALUES (%s, %s, %s, %s);", (song.digest, song.length, song.metadata, song.digest))
-                cur.execute("SELECT * FROM `esong` WHERE `hash`=%s LIMIT 1;",
-                           (song.digest,))
-                return cur.fetchone()['id']
+                cur.execute("INSERT INTO `esong` (`hash`, `len`, `meta`, \
+                `hash_link`) VALUES (%s, %s, %s, %s);",
+                            (song.digest, song.length, song.metadata,
+                             song.digest))
+                songid = cur.lastrowid
+        _songid_cache[song.digest] = songid
+        return songid
+
+    @staticmethod
+    def warm_songids():
+        """Fills the digest to songid cache used by get_songid with all
+        rows of `esong`, and checks the indexes it relies on"""
+        check_unique_columns()
+        with MySQLNormalCursor() as cur:
+            # The oldest row wins if a hash has duplicates
+            cur.execute("SELECT `hash`, `id` FROM `esong` ORDER BY `id` DESC;")
+            _songid_cache.update(cur)
+        logging.info("Cached %d songids", len(_songid_cache))
 
     @staticmethod
     def fix_encoding(metadata):
@@ -480,52 +672,95 @@ class Song(object):
 
     @classmethod
     def nick(cls, nick, limit=5, tracks=False):
-        with MySQLCursor() as cur:
-            if (limit):
-                cur.execute("SELECT esong.len AS len, esong.meta AS meta, \
-                tracks.id AS trackid FROM tracks RIGHT JOIN esong ON tracks.hash \
-                = esong.hash JOIN efave ON efave.isong = esong.id JOIN enick \
-                ON efave.inick = enick.id WHERE enick.nick = %s LIMIT %s;",
-                            (nick, limit))
+        """Returns a list of the favorites of `nick`, use Song.iter_nick
+        for users with a lot of favorites"""
+        return list(cls.iter_nick(nick, limit=limit, tracks=tracks))
+
+    @classmethod
+    def iter_nick(cls, nick, limit=None, tracks=False):
+        """Generator over the favorites of `nick` as Song objects, rows
+        are streamed from the database with a server-side cursor.
+
+        limit: maximum amount of songs, None for all of them
+        tracks: only return songs that have an entry in `tracks`
+        """
+        for row in cls._stream_nick(nick, limit, tracks):
+            yield cls._from_fave_row(row)
+
+    @classmethod
+    def sample_nick(cls, nick, k=1, requestable=False, tracks=False):
+        """Returns a list of up to `k` random favorites of `nick`, with
+        requestable=True only songs that can be requested right now are
+        picked. Uses reservoir sampling over a streamed result so the
+        favorites are never all in memory. See iter_nick for `tracks`"""
+        now = time.time()
+        reservoir = []
+        seen = 0
+        for row in cls._stream_nick(nick, None, tracks or requestable):
+            if requestable:
+                delay = songdelay(row['requestcount'] or 0)
+                if (not row['usable'] or
+                        now - (row['lp'] or 0) < delay or
+                        now - (row['lr'] or 0) < delay):
+                    continue
+            seen += 1
+            if len(reservoir) < k:
+                reservoir.append(row)
             else:
-                cur.execute("SELECT esong.len AS len, esong.meta AS meta, \
-                tracks.id AS trackid FROM tracks RIGHT JOIN esong ON tracks.hash \
-                = esong.hash JOIN efave ON efave.isong = esong.id JOIN enick \
-                ON efave.inick = enick.id WHERE enick.nick = %s;", (nick,))
-            result = []
+                index = random.randrange(seen)
+                if index < k:
+                    reservoir[index] = row
+        return [cls._from_fave_row(row) for row in reservoir]
+
+    @staticmethod
+    def _stream_nick(nick, limit, tracks):
+        """Streams the favorite rows of `nick` for iter_nick and
+        sample_nick, rows have the track columns needed to construct a Song
+        and check if it can be requested"""
+        query = "SELECT esong.len AS len, esong.meta AS meta, \
+        tracks.id AS trackid, tracks.path AS path, tracks.usable AS usable, \
+        UNIX_TIMESTAMP(tracks.lastplayed) AS lp, \
+        UNIX_TIMESTAMP(tracks.lastrequested) AS lr, \
+        tracks.requestcount AS requestcount FROM tracks RIGHT JOIN esong \
+        ON tracks.hash = esong.hash JOIN efave ON efave.isong = esong.id \
+        JOIN enick ON efave.inick = enick.id WHERE enick.nick = %s"
+        args = (nick,)
+        if (tracks):
+            query += " AND tracks.id IS NOT NULL"
+        if (limit):
+            query += " LIMIT %s"
+            args += (limit,)
+        with MySQLStreamCursor() as cur:
+            cur.execute(query + ";", args)
             for row in cur:
-                if (tracks and row['trackid']) or (not tracks):
-                    result.append(cls(
-                                  id=row['trackid'],
-                                  meta=row['meta'],
-                                  length=row['len']))
-            return result
+                yield row
 
     @classmethod
-    def random(cls):
+    def _from_fave_row(cls, row):
         from os.path import join
-        with MySQLCursor() as cur:
-            cur.execute("SELECT * FROM `tracks` WHERE `usable`='1' \
-                    ORDER BY RAND() LIMIT 0,1;")
-            for row in cur:
-                return cls(id=row['id'],
-                           meta=row['track'] if row['artist'] == u''
-                           else row['artist'] + u' - ' + row['track'],
-                           filename=join(config.music_directory, row['path']))
+        filename = None
+        if (row['path'] is not None):
+            filename = join(config.music_directory, row['path'])
+        return cls(id=row['trackid'], meta=row['meta'], length=row['len'],
+                   filename=filename)
+
+    @classmethod
+    def random(cls, requestable=False, weight=None):
+        """Returns a random usable song, or None if there is none. See
+        Catalog.random for the arguments"""
+        from .catalog import Catalog
+        trackid = Catalog().random(requestable=requestable, weight=weight)
+        if (trackid is None):
+            return None
+        return cls(id=trackid)
 
     def update_index(self):
-        """Updates the elasticsearch index for the song when changing it."""
+        """Queues an update of the elasticsearch index for the song when
+        changing it, the update itself is sent in the background."""
         if not self.afk:
             return
 
-        url = config.index_route.format(self.id)
-
-        try:
-            requests.get(url, auth=(config.index_user, config.index_pass))
-        except:
-            # all that matters is that it's pinged.
-            # the response is for sanity checking.
-            pass
+        IndexQueue().put(self.id)
 
     def __str__(self):
         return self.__repr__()
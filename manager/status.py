@@ -1,17 +1,79 @@
 from __future__ import absolute_import
+import os
 import time
 import re
 import logging
+import itertools
 import threading
+import collections
 from multiprocessing.managers import RemoteError
-
-import requests
+from multiprocessing.pool import ThreadPool
 
 from .util import MySQLNormalCursor, MySQLCursor, get_ms
 from .song import Song
+from .writer import Batch, Writer
+from .catalog import Catalog
+from .snapshot import StatusSnapshot, connect_snapshot
+from .httpclient import HTTPClient
 import bootstrap
 import config
 
+class LPCache(object):
+    """Ring buffer of the last `size` played songs, newest first.
+
+    It is filled from `eplay` on first use and after that kept up to date
+    by NPCache whenever the now playing song changes, so LP doesn't have
+    to sort `eplay` on every call.
+    """
+    size = 50
+
+    def __init__(self):
+        super(LPCache, self).__init__()
+        self.lock = threading.RLock()
+        self.songs = collections.deque(maxlen=self.size)
+        self.loaded = False
+
+    def load(self):
+        """(Re)fills the buffer from the database"""
+        songs = list(LP.query(self.size))
+        with self.lock:
+            self.songs.clear()
+            self.songs.extend(songs)
+            self.loaded = True
+
+    def check(self):
+        with self.lock:
+            if (not self.loaded):
+                self.load()
+
+    def invalidate(self):
+        """Makes the next use reload the buffer from the database"""
+        with self.lock:
+            self.loaded = False
+
+    def push(self, song):
+        """Adds `song` as the most recently played song, nothing is done
+        when the buffer isn't loaded since loading will include it"""
+        with self.lock:
+            if (not self.loaded):
+                return
+            if (not self.songs) or (self.songs[0] != song):
+                self.songs.appendleft(song)
+
+    def get(self, amount):
+        """Returns up to `amount` songs, or None if the buffer can't answer
+        that many"""
+        with self.lock:
+            self.check()
+            if (amount > self.size):
+                return None
+            songs = list(itertools.islice(self.songs, amount))
+        # Fresh objects, so nothing cached on them outlives the caller
+        return [Song(meta=song.metadata) for song in songs]
+
+lp_cache = LPCache()
+
+
 class LP(object):
     def get(self, amount=5):
         return list(self.iter(amount))
@@ -19,6 +81,15 @@ class LP(object):
     def iter(self, amount=5):
         if (not isinstance(amount, int)):
             pass
+        songs = lp_cache.get(amount)
+        if (songs is None):
+            songs = self.query(amount)
+        for song in songs:
+            yield song
+
+    @staticmethod
+    def query(amount):
+        """Reads the last `amount` played songs from the database"""
         with MySQLCursor() as cur:
             cur.execute("SELECT esong.meta FROM eplay JOIN esong ON \
             esong.id = eplay.isong ORDER BY eplay.dt DESC LIMIT %s;",
@@ -30,10 +101,79 @@ class LP(object):
         return self.iter()
 
 
+class StatusHandler(object):
+    """A status handler together with statistics about its calls.
+
+    A handler never runs twice at the same time. A status dispatched while
+    it is still running replaces any status waiting for it, and the
+    handler is called again with that once it finished.
+    """
+    # Log a warning when a call takes longer than this many seconds
+    slow = 5
+
+    def __init__(self, handle):
+        super(StatusHandler, self).__init__()
+        self.handle = handle
+        self.lock = threading.Lock()
+        self.running = False
+        self.pending = None
+        self.calls = 0
+        self.errors = 0
+        self.skipped = 0
+        self.duration = 0
+        self.max_duration = 0
+
+    def dispatch(self, status, pool):
+        """Runs the handler with `status` on `pool`"""
+        with self.lock:
+            if (self.running):
+                if (self.pending is not None):
+                    self.skipped += 1
+                self.pending = status
+                return
+            self.running = True
+        pool.apply_async(self.run, (status,))
+
+    def run(self, status):
+        while True:
+            start = time.time()
+            try:
+                self.handle(status)
+            except:
+                self.errors += 1
+                logging.exception("Status handler failed")
+            self.duration = time.time() - start
+            self.max_duration = max(self.max_duration, self.duration)
+            self.calls += 1
+            if (self.duration > self.slow):
+                logging.warning("Status handler %r took %.1f seconds",
+                                self.handle, self.duration)
+            with self.lock:
+                status, self.pending = self.pending, None
+                if (status is None):
+                    self.running = False
+                    return
+
+
 class Status(object):
+    """The status of the stream on the master server.
+
+    One process runs the status poller (see `start_status_poller`), which
+    fetches the status and publishes it as a StatusSnapshot. Every other
+    process reads that snapshot instead of asking the master server, and
+    only fetches the status itself when there is no fresh snapshot.
+    """
     __metaclass__ = bootstrap.Singleton
     _timeout = bootstrap.Switch(True, 0)
     _handlers = []
+    # Set in the process running the status poller
+    publishing = False
+    # Snapshots older than this many seconds are not used
+    stale = 60
+    _snapshot = None
+    _reconnect = bootstrap.Switch(True, 0)
+    _pool = None
+    handler_threads = 2
 
     @property
     def listeners(self):
@@ -102,49 +242,208 @@ class Status(object):
 
     @property
     def status(self):
+        """The current status, never calls the handlers"""
+        status = self.snapshot()
+        if (status is None):
+            if (not self._timeout):
+                return self.fetch()
+            return self._status
+        self._status = status
+        self._timeout.reset(1)
+        return self._status
+
+    def source(self):
+        """Returns the StatusSnapshot of this process if it runs the status
+        poller, a proxy of the one in the poller process or None"""
+        if (self.publishing):
+            return StatusSnapshot()
+        if (self._snapshot is None and not self._reconnect):
+            try:
+                Status._snapshot = connect_snapshot()
+            except:
+                # Nobody is serving a snapshot, don't retry right away
+                self._reconnect.reset(30)
+        return self._snapshot
+
+    def snapshot(self):
+        """Returns the status published by the status poller, or None if
+        there is no poller or its snapshot is stale"""
+        source = self.source()
+        if (source is None):
+            return None
+        try:
+            version, updated, status = source.get()
+        except:
+            logging.warning("Lost connection to the status snapshot")
+            Status._snapshot = None
+            return None
+        if (time.time() - updated > self.stale):
+            return None
+        return status
+
+    def wait(self, version=None, timeout=10):
+        """Waits at most `timeout` seconds for the snapshot to change from
+        `version` and returns the version it has now. Without a snapshot
+        this just sleeps and returns None"""
+        source = self.source()
+        if (source is not None):
+            try:
+                return source.wait(version, timeout)[0]
+            except:
+                logging.warning("Lost connection to the status snapshot")
+                Status._snapshot = None
+        time.sleep(timeout)
+        return None
+
+    def fetch(self):
+        """Fetches the status from the master server"""
         import streamstatus
         self._status = streamstatus.get_status(config.master_server)
         self._timeout.reset(9)
-        for handle in self._handlers:
-            try:
-                handle(self._status)
-            except:
-                logging.exception("Status handler failed")
         return self._status
 
+    def poll(self):
+        """Fetches the status, publishes it if this process runs the status
+        poller and hands it to the handlers"""
+        status = self.fetch()
+        if (self.publishing):
+            StatusSnapshot().publish(status)
+        if (self._handlers and self._pool is None):
+            Status._pool = ThreadPool(self.handler_threads)
+        for handler in self._handlers:
+            handler.dispatch(status, self._pool)
+        return status
+
     def add_handler(self, handle):
         """Adds a handler to the status object.
 
-        The handle is called every time the cached status dict is updated with
-        new values with the current dict as only argument.
+        The handle is called with the status dict as only argument every
+        time the status poller fetched it, on a thread of the handler pool
+        so the poller never waits on it. See StatusHandler.
         """
-        self._handlers.append(handle)
+        self._handlers.append(StatusHandler(handle))
+
+    @property
+    def handlers(self):
+        """List of StatusHandler objects with the timing and error counts
+        of each handler"""
+        return list(self._handlers)
 
     def update(self):
-        """Updates the database with current collected info"""
-        with MySQLNormalCursor() as cur:
-            cur.execute(
-                "INSERT INTO streamstatus (id, lastset, listeners)"
-                " VALUES (0, NOW(), %s) ON DUPLICATE KEY UPDATE"
-                " lastset=NOW(), listeners=%s;",
-                (self.listeners, self.listeners),
-            )
+        """Queues a database update with current collected info, nothing is
+        written when the info didn't change since the last update"""
+        batch = Batch()
+        batch.execute(
+            "INSERT INTO streamstatus (id, lastset, listeners)"
+            " VALUES (0, NOW(), %s) ON DUPLICATE KEY UPDATE"
+            " lastset=NOW(), listeners=%s;",
+            (self.listeners, self.listeners),
+        )
+        Writer().submit(batch, key="listeners")
 
 
 class DJError(Exception):
     pass
 
 
+class DJMatcher(object):
+    """Matches names against the wildcards in `config.djfile`.
+
+    The file is compiled into a few regular expressions with one group per
+    line, and only read and compiled again when its mtime changes.
+    """
+    # Python limits the amount of groups in a single expression
+    lines_per_regex = 90
+
+    def __init__(self):
+        super(DJMatcher, self).__init__()
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.regexes = []
+
+    def check(self):
+        mtime = os.path.getmtime(config.djfile)
+        with self.lock:
+            if (mtime == self.mtime):
+                return
+            self.regexes = self.compile(config.djfile)
+            self.mtime = mtime
+
+    @classmethod
+    def compile(cls, filename):
+        """Returns a list of (regex, list of dj names) tuples, the n-th
+        group of a regex belongs to the n-th dj name"""
+        lines = []
+        with open(filename) as f:
+            for line in f:
+                if (not line.strip()):
+                    continue
+                wildcards, dj = line.split('@')
+
+                wildcards = wildcards.split('!')
+                dj = dj.strip()
+
+                patterns = []
+                for wc in wildcards:
+                    wc = re.escape(wc)
+                    wc = wc.replace('*', '.*')
+                    patterns.append(wc)
+                lines.append((u"(" + u"|".join(patterns) + u")", unicode(dj)))
+
+        regexes = []
+        for i in xrange(0, len(lines), cls.lines_per_regex):
+            chunk = lines[i:i + cls.lines_per_regex]
+            regex = re.compile(u"^(?:" + u"|".join(p for p, dj in chunk) + u")",
+                               re.I)
+            regexes.append((regex, [dj for p, dj in chunk]))
+        return regexes
+
+    def match(self, name):
+        """Returns the dj name belonging to `name` or None"""
+        self.check()
+        for regex, djs in self.regexes:
+            match = regex.match(name)
+            if (match):
+                return djs[match.lastindex - 1]
+        return None
+
+dj_matcher = DJMatcher()
+
+
 class DJ(object):
+    # Cached (djid, djname, user) of the current DJ, the setters clear it.
+    # Other processes can change the DJ as well, so it is only trusted for
+    # `timeout` seconds.
+    _state = None
+    _read = 0
+    timeout = 10
+
+    @classmethod
+    def state(cls):
+        """Returns the cached (djid, djname, user) tuple, or None if there
+        is no streamstatus row"""
+        if (cls._read == 0) or (time.time() - cls._read > cls.timeout):
+            with MySQLNormalCursor() as cur:
+                cur.execute("SELECT streamstatus.djid, streamstatus.djname, \
+                users.user FROM streamstatus LEFT JOIN users ON \
+                users.djid = streamstatus.djid LIMIT 1;")
+                cls._state = cur.fetchone()
+            cls._read = time.time()
+        return cls._state
+
+    @classmethod
+    def invalidate(cls):
+        """Makes the next use read the DJ from the database again"""
+        cls._read = 0
+
     @property
     def id(self):
-        with MySQLNormalCursor() as cur:
-            cur.execute("SELECT djid FROM streamstatus LIMIT 1;")
-            for djid, in cur:
-                return djid
+        state = self.state()
+        if (state is not None):
+            return state[0]
 
-            self.id = 18
-            return 18
+        self.id = 18
+        return 18
 
     @id.setter
     def id(self, value):
@@ -152,9 +451,11 @@ class DJ(object):
             raise TypeError("Expected integer")
 
         with MySQLCursor() as cur:
-            cur.execute("SELECT user FROM users WHERE djid=%s LIMIT 1;")
+            cur.execute("SELECT user FROM users WHERE djid=%s LIMIT 1;",
+                        (value,))
             for user, in cur:
                 cur.execute("UPDATE streamstatus SET djid=%s, djname=%s", (value, user))
+                self.invalidate()
                 return
 
             # Only reached if the for above doesn't run at all
@@ -162,11 +463,10 @@ class DJ(object):
 
     @property
     def name(self):
-	with MySQLNormalCursor() as cur:
-            cur.execute("SELECT djname FROM streamstatus LIMIT 1;")
-            for name, in cur:
-                return name
-            return None
+        state = self.state()
+        if (state is not None):
+            return state[1]
+        return None
 
     @name.setter
     def name(self, name):
@@ -177,46 +477,109 @@ class DJ(object):
         with MySQLCursor() as cur:
             cur.execute("UPDATE streamstatus SET djid=(SELECT djid FROM users WHERE user=%s LIMIT 1), djname=%s",
                         (username, name))
+        self.invalidate()
 
     @property
     def user(self):
-        with MySQLNormalCursor() as cur:
-            cur.execute("SELECT user FROM users WHERE djid=(SELECT djid FROM streamstatus LIMIT 1);")
-            for user, in cur:
-                return user
-            self.id = 18 # MAGIC CONSTANTS (really just AFK streamers ID)
-            return 'AFK'
+        state = self.state()
+        if (state is not None) and (state[2] is not None):
+            return state[2]
+        self.id = 18 # MAGIC CONSTANTS (really just AFK streamers ID)
+        return 'AFK'
 
     @classmethod
     def is_valid(cls, name):
-        with open(config.djfile) as f:
-            for line in f:
-                wildcards, dj = line.split('@')
+        return dj_matcher.match(name)
 
-                wildcards = wildcards.split('!')
-                dj = dj.strip()
 
-                for wc in wildcards:
-                    wc = re.escape(wc)
-                    wc = '^' + wc
-                    wc = wc.replace('*', '.*')
-                    if re.match(wc, name, re.I):
-                        return unicode(dj)
+class NPCache(object):
+    """In-memory copy of the now playing state.
 
+    The process that calls NP.change owns the state and never reads it back
+    from the database, other processes get it pushed to them through
+    bot.np_update and only fall back to the `streamstatus` table every
+    `refresh` seconds in case a notification got lost.
+
+    The state is a dict with the keys 'trackid', 'meta', 'length',
+    'filename', 'start' and 'end'.
+    """
+    refresh = 60
 
-class NP(Song):
     def __init__(self):
+        super(NPCache, self).__init__()
+        self.lock = threading.RLock()
+        self.state = None
+        self.loaded = 0
+        self.authoritative = False
+
+    def get(self):
+        """Returns a copy of the current state, loading it from the database
+        when we don't own it and it is older than `refresh` seconds"""
+        with self.lock:
+            if (self.state is None) or (not self.authoritative and
+                                        time.time() - self.loaded > self.refresh):
+                previous = self.state
+                self.state = self.load(previous)
+                self.loaded = time.time()
+                if (previous is not None and
+                        previous['meta'] != self.state['meta']):
+                    # We missed a change, so the last played are off too
+                    lp_cache.invalidate()
+            return dict(self.state)
+
+    def set(self, state, authoritative=False):
+        """Replaces the current state, authoritative should only be True
+        in the process that changes the now playing song. The previous song
+        is added to the last played songs"""
+        with self.lock:
+            previous = self.state
+            if (previous is not None and previous['meta'] and
+                    previous['meta'] != state['meta']):
+                lp_cache.push(Song(meta=previous['meta']))
+            self.state = dict(state)
+            self.loaded = time.time()
+            self.authoritative = self.authoritative or authoritative
+
+    def update(self, **kwargs):
+        """Changes keys of the current state if there is one"""
+        with self.lock:
+            if (self.state is not None):
+                self.state.update(kwargs)
+
+    @staticmethod
+    def load(previous=None):
+        """Reads the state from the `streamstatus` table, the length and
+        filename of `previous` are reused when the song didn't change"""
         with MySQLCursor() as cur:
-            cur.execute("SELECT * FROM `streamstatus` LIMIT 1;")
-            for row in cur:
-                Song.__init__(self, id=row['trackid'], meta=row['np'])
-                self._end = row["end_time"]
-                self._start = row["start_time"]
-                break
-            else:
-                super(NP, self).__init__(meta=u"", length=0.0)
-                self._end = 0
-                self._start = int(time.time())
+            cur.execute("SELECT trackid, np, start_time, end_time \
+            FROM `streamstatus` LIMIT 1;")
+            row = cur.fetchone()
+        if (row is None):
+            return {"trackid": 0, "meta": u"", "length": 0.0,
+                    "filename": None, "start": int(time.time()), "end": 0}
+
+        state = {"trackid": row['trackid'] or 0, "meta": row['np'],
+                 "start": row['start_time'], "end": row['end_time']}
+        if (previous is not None and previous['trackid'] == state['trackid']
+                and previous['meta'] == state['meta']):
+            state['length'] = previous['length']
+            state['filename'] = previous['filename']
+        else:
+            song = Song(id=state['trackid'] or None, meta=state['meta'])
+            state['length'] = song.length
+            state['filename'] = song.filename
+        return state
+
+np_cache = NPCache()
+
+
+class NP(Song):
+    def __init__(self):
+        state = np_cache.get()
+        Song.__init__(self, id=state['trackid'] or None, meta=state['meta'],
+                      length=state['length'], filename=state['filename'])
+        self._start = state['start']
+        self._end = state['end']
 
     @property
     def start(self):
@@ -225,8 +588,11 @@ class NP(Song):
     @start.setter
     def start(self, value):
         self._start = value
-        with MySQLCursor() as cur:
-            cur.execute("UPDATE `streamstatus` SET `start_time`=%s", (value,))
+        np_cache.update(start=value)
+        batch = Batch()
+        batch.execute("UPDATE `streamstatus` SET `start_time`=%s", (value,))
+        Writer().submit(batch)
+        self.publish()
 
     @property
     def end(self):
@@ -235,17 +601,38 @@ class NP(Song):
     @end.setter
     def end(self, value):
         self._end = value
-        with MySQLCursor() as cur:
-            cur.execute("UPDATE `streamstatus` SET `end_time`=%s", (value,))
+        np_cache.update(end=value)
+        batch = Batch()
+        batch.execute("UPDATE `streamstatus` SET `end_time`=%s", (value,))
+        Writer().submit(batch)
+        self.publish()
 
     def remaining(self, remaining):
-        self.update(length=(time.time() + remaining) - self.start)
-        self.end = time.time() + remaining
+        batch = Batch()
+        self.update(length=(time.time() + remaining) - self.start,
+                    batch=batch)
+        self._end = time.time() + remaining
+        batch.execute("UPDATE `streamstatus` SET `end_time`=%s",
+                      (self._end,))
+        np_cache.update(length=self.length, end=self._end)
+        Writer().submit(batch)
+        self.publish()
+
+    @staticmethod
+    def publish():
+        """Pushes the now playing state to the other processes"""
+        import bot
+        bot.np_update(np_cache.get())
 
     @property
     def position(self):
         return int(time.time() - self.start)
 
+    @property
+    def stats_expire(self):
+        """Stats of the playing song are kept until the song ends"""
+        return max(self.end, time.time() + self.stats_timeout)
+
     @property
     def positionf(self):
         return get_ms(self.position)
@@ -253,24 +640,31 @@ class NP(Song):
     @classmethod
     def change(cls, song):
         """Changes the current playing song to 'song' which should be an
-        manager.Song object"""
+        manager.Song object
+
+        All database writes are queued on the Writer, the writes belonging
+        to the track change are done in a single transaction"""
         import re
         current = cls()
         # old stuff
-        if (song.afk):
-            Status().requests_enabled = True
-        else:
-            Status().requests_enabled = False
+        requesting = Batch()
+        requesting.execute("UPDATE streamstatus SET requesting=%s;",
+                           (song.afk,))
+        # Not keyed, other processes change this flag as well
+        Writer().submit(requesting)
         if (current == song):
             return
+        batch = Batch()
         if (current.metadata != u""):
-            current.update(lp=time.time())
+            current.update(lp=time.time(), batch=batch)
+            Catalog().touch(current.id, lp=time.time())
             if (current.length == 0):
-                current.update(length=(time.time() - current._start))
+                current.update(length=(time.time() - current._start),
+                               batch=batch)
 
-        # New stuff
-        current.start = int(time.time())
-        current.end = int(time.time()) + song.length
+        # New stuff, start and end are written with the streamstatus row
+        current._start = int(time.time())
+        current._end = int(time.time()) + song.length
 
         # tunein
         def tunein(song):
@@ -294,7 +688,8 @@ class NP(Song):
                         urlparams['title'] = title.encode(
                             'utf-8') if isinstance(title,
                                                    unicode) else title
-                r = requests.get(url, params=urlparams, timeout=8)
+                r = HTTPClient().get(url, endpoint="tunein",
+                                     params=urlparams, timeout=8)
                 r.raise_for_status()
             except:
                 logging.warning("Error when contacting tuneIn API")
@@ -303,25 +698,31 @@ class NP(Song):
         tunein_thread.daemon = True
         tunein_thread.start()
 
-        with MySQLCursor() as cur:
-            djid = DJ().id
-            cur.execute("INSERT INTO `streamstatus` (id, lastset, \
-                            np, djid, listeners, start_time, end_time, \
-                            isafkstream, trackid) VALUES (0, NOW(), %(np)s, %(djid)s, \
-                            %(listener)s, %(start)s, %(end)s, %(afk)s, %(trackid)s) ON DUPLICATE KEY \
-                            UPDATE `lastset`=NOW(), `np`=%(np)s, `djid`=%(djid)s, \
-                            `listeners`=%(listener)s, `start_time`=%(start)s, \
-                            `end_time`=%(end)s, `isafkstream`=%(afk)s, `trackid`=%(trackid)s;",
-                        {"np": song.metadata,
-                         "djid": djid if djid else 18,
-                         "listener": Status().listeners,
-                         "start": current._start,
-                         "end": current._end,
-                         "afk": 1 if song.afk else 0,
-                         "trackid": song.id
-                         })
+        state = {"trackid": song.id, "meta": song.metadata,
+                 "length": song.length, "filename": song.filename,
+                 "start": current._start, "end": current._end}
+        np_cache.set(state, authoritative=True)
+
+        djid = DJ().id
+        batch.execute("INSERT INTO `streamstatus` (id, lastset, \
+                        np, djid, listeners, start_time, end_time, \
+                        isafkstream, trackid) VALUES (0, NOW(), %(np)s, %(djid)s, \
+                        %(listener)s, %(start)s, %(end)s, %(afk)s, %(trackid)s) ON DUPLICATE KEY \
+                        UPDATE `lastset`=NOW(), `np`=%(np)s, `djid`=%(djid)s, \
+                        `listeners`=%(listener)s, `start_time`=%(start)s, \
+                        `end_time`=%(end)s, `isafkstream`=%(afk)s, `trackid`=%(trackid)s;",
+                    {"np": song.metadata,
+                     "djid": djid if djid else 18,
+                     "listener": Status().listeners,
+                     "start": current._start,
+                     "end": current._end,
+                     "afk": 1 if song.afk else 0,
+                     "trackid": song.id
+                     })
+        Writer().submit(batch)
 
         import bot
+        bot.np_update(state)
         bot.announce()
 
     def __repr__(self):
@@ -0,0 +1,196 @@
+from __future__ import absolute_import
+import os
+import time
+import logging
+import threading
+
+import numpy
+
+import bootstrap
+import config
+
+
+class Ring(object):
+    """Fixed-size ring buffer with one point per `resolution` seconds.
+
+    A point keeps the sum and amount of the listener counts added during
+    its interval, their peak and the last dj. The slot of a point is its
+    interval number modulo `size`, a slot holding an older interval is
+    reset when it is reused.
+    """
+    fields = (("start", numpy.int64),
+              ("total", numpy.float64),
+              ("count", numpy.int32),
+              ("peak", numpy.int32),
+              ("dj", numpy.int32))
+
+    def __init__(self, resolution, size):
+        super(Ring, self).__init__()
+        self.resolution = resolution
+        self.size = size
+        for name, dtype in self.fields:
+            setattr(self, name, numpy.zeros(size, dtype=dtype))
+
+    @property
+    def span(self):
+        """Seconds of history the ring can hold"""
+        return self.resolution * self.size
+
+    def add(self, now, listeners, dj):
+        interval = int(now // self.resolution)
+        slot = interval % self.size
+        start = interval * self.resolution
+        if self.start[slot] != start:
+            self.start[slot] = start
+            self.total[slot] = 0
+            self.count[slot] = 0
+            self.peak[slot] = 0
+        self.total[slot] += listeners
+        self.count[slot] += 1
+        self.peak[slot] = max(self.peak[slot], listeners)
+        self.dj[slot] = dj
+
+    def select(self, begin, end):
+        """Returns the slots of the points starting in [begin, end), oldest
+        first"""
+        mask = (self.start >= begin) & (self.start < end) & (self.count > 0)
+        slots = numpy.flatnonzero(mask)
+        return slots[numpy.argsort(self.start[slots])]
+
+    def arrays(self, prefix):
+        return dict((prefix + name, getattr(self, name))
+                    for name, dtype in self.fields)
+
+    def restore(self, arrays, prefix):
+        for name, dtype in self.fields:
+            column = arrays.get(prefix + name)
+            if column is not None and len(column) == self.size:
+                setattr(self, name, column.astype(dtype))
+
+
+class TimeSeries(object):
+    """Listener counts, peaks and dj over time, without asking MySQL.
+
+    Every count is added to a ring at each of the `resolutions`, so recent
+    history is kept at 10 second resolution and older history at 1 minute
+    and 1 hour. The process adding counts saves the rings to
+    `config.timeseries_file` every `save_interval` seconds, by default
+    listeners.npz in `config.data_directory` or the top directory of the
+    project. Other processes load the file on first use and again
+    whenever it changed.
+    """
+    __metaclass__ = bootstrap.Singleton
+    # (seconds per point, amount of points)
+    resolutions = ((10, 8640),      # a day
+                   (60, 10080),     # a week
+                   (3600, 8760))    # a year
+    save_interval = 300
+
+    def __init__(self):
+        super(TimeSeries, self).__init__()
+        self.lock = threading.Lock()
+        self.rings = [Ring(resolution, size)
+                      for resolution, size in self.resolutions]
+        self.filename = getattr(config, "timeseries_file", os.path.join(
+            getattr(config, "data_directory", os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))),
+            "listeners.npz"))
+        self.saved = time.time()
+        # Set once counts are added here, the file is ours from then on
+        self.writing = False
+        self.mtime = None
+        self.load()
+
+    def add(self, listeners, dj=0, now=None):
+        """Adds a listener count measured at unixtime `now`"""
+        now = time.time() if now is None else now
+        self.writing = True
+        with self.lock:
+            for ring in self.rings:
+                ring.add(now, listeners, dj or 0)
+        if now - self.saved > self.save_interval:
+            self.save()
+
+    def ring(self, begin, resolution=None):
+        """Returns the ring with `resolution`, or the finest ring that still
+        holds unixtime `begin`"""
+        if resolution is not None:
+            for ring in self.rings:
+                if ring.resolution == resolution:
+                    return ring
+            raise ValueError("No ring with a resolution of {0} seconds"
+                             .format(resolution))
+        for ring in self.rings:
+            if time.time() - begin <= ring.span:
+                return ring
+        return self.rings[-1]
+
+    def query(self, begin, end=None, resolution=None):
+        """Returns a list of (start, average, peak, dj) tuples for the
+        points between unixtimes `begin` and `end`, oldest first"""
+        end = time.time() if end is None else end
+        self.check()
+        ring = self.ring(begin, resolution)
+        with self.lock:
+            slots = ring.select(begin, end)
+            return [(int(ring.start[slot]),
+                     float(ring.total[slot]) / ring.count[slot],
+                     int(ring.peak[slot]), int(ring.dj[slot]))
+                    for slot in slots]
+
+    def aggregate(self, begin, end=None, resolution=None):
+        """Returns a dict with the average and peak listener count between
+        unixtimes `begin` and `end`, and the amount of samples"""
+        end = time.time() if end is None else end
+        self.check()
+        ring = self.ring(begin, resolution)
+        with self.lock:
+            slots = ring.select(begin, end)
+            samples = int(ring.count[slots].sum())
+            return {"average": (float(ring.total[slots].sum()) / samples
+                                if samples else 0),
+                    "peak": int(ring.peak[slots].max()) if len(slots) else 0,
+                    "samples": samples}
+
+    def save(self):
+        """Writes the rings to the file, replacing it atomically"""
+        arrays = {}
+        with self.lock:
+            for ring in self.rings:
+                arrays.update(ring.arrays("r{0}_".format(ring.resolution)))
+            arrays = dict((name, column.copy())
+                          for name, column in arrays.iteritems())
+        self.saved = time.time()
+        temporary = self.filename + ".tmp"
+        try:
+            with open(temporary, "wb") as f:
+                numpy.savez_compressed(f, **arrays)
+            os.rename(temporary, self.filename)
+        except (IOError, OSError):
+            logging.exception("Saving the listener time series failed")
+
+    def check(self):
+        """Loads the file again if another process saved it since"""
+        if (self.writing):
+            return
+        try:
+            mtime = os.path.getmtime(self.filename)
+        except OSError:
+            return
+        if (mtime != self.mtime):
+            self.load()
+
+    def load(self):
+        try:
+            self.mtime = os.path.getmtime(self.filename)
+            with open(self.filename, "rb") as f:
+                npz = numpy.load(f)
+                arrays = dict((name, npz[name]) for name in npz.files)
+        except (IOError, OSError):
+            return
+        except:
+            logging.exception("Loading the listener time series failed")
+            return
+        with self.lock:
+            for ring in self.rings:
+                ring.restore(arrays, "r{0}_".format(ring.resolution))
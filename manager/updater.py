@@ -3,7 +3,10 @@ import threading
 import time
 import logging
 
-from .status import Status
+from .status import Status, DJ
+from .writer import Writer
+from .snapshot import serve_snapshot
+from .timeseries import TimeSeries
 
 def start_updater():
     global updater_event, updater_thread
@@ -18,16 +21,55 @@ def start_updater():
 def updater(event):
     logging.info("THREADING: Starting now playing updater")
     status = Status()
+    version = None
+    written = None
     while not event.is_set():
         try:
+            # Wakes up on status changes, and every 10 seconds for the series
+            version = status.wait(version, 10)
             if (status.online):
-              status.update()
+                listeners = status.listeners
+                TimeSeries().add(listeners, DJ().id)
+                if (listeners != written):
+                    status.update()
+                    written = listeners
         except:
             logging.exception("THREADING: now playing updater encountered an error")
-        time.sleep(10)
+            time.sleep(10)
     logging.info("THREADING: Stopping now playing updater")
 
 
 def stop_updater():
     updater_event.set()
     updater_thread.join(11)
+    Writer().flush()
+    TimeSeries().save()
+
+
+def start_status_poller(interval=9):
+    """Fetches the stream status every `interval` seconds in this process
+    and serves it to the other processes, see Status"""
+    global poller_event, poller_thread
+    poller_event = threading.Event()
+    Status.publishing = True
+    serve_snapshot()
+
+    def poller():
+        logging.info("THREADING: Starting status poller")
+        status = Status()
+        while not poller_event.is_set():
+            try:
+                status.poll()
+            except:
+                logging.exception("THREADING: status poller encountered an error")
+            poller_event.wait(interval)
+        logging.info("THREADING: Stopping status poller")
+
+    poller_thread = threading.Thread(name="Status Poller", target=poller)
+    poller_thread.daemon = 1
+    poller_thread.start()
+
+
+def stop_status_poller():
+    poller_event.set()
+    poller_thread.join(11)
@@ -1,47 +1,40 @@
 from __future__ import absolute_import
 import time
+import math
 import functools
 import threading
 
 import MySQLdb
 import MySQLdb.cursors
-import elasticsearch
 
 import config
 
 
-elasticsearch_instance = elasticsearch.Elasticsearch(config.elasticsearch_server)
-
-
 def search(query, limit=5):
-    query = {
-       "query": {
-           "match": {
-                "_all": {
-                    "query": query,
-                    "operator": "and",
-                }
-            },
-        },
-        "from": 0, "size": limit,
-        "sort": [
-            { "requests": { "order": "desc", "ignore_unmapped": True }},
-            { "_score": { "order": "desc" }}
-        ]
-    }
-
-    res = elasticsearch_instance.search(config.elasticsearch_index, body=query)
-
-    return (item['_source'] for item in res['hits']['hits'])
+    """Searches for tracks matching `query` with the backend chosen by
+    `config.search_backend`, returns an iterable of dicts with at least
+    the key "id". Results are cached for a short while, see
+    manager.searchbackend"""
+    from .searchbackend import get_backend, SearchCache
+    results = SearchCache().get(query, limit)
+    if (results is None):
+        results = list(get_backend().search(query, limit))
+        SearchCache().put(query, limit, results)
+    return results
 
 
 class MySQLCursor(object):
-    """Return a connected MySQLdb cursor object"""
+    """Return a connected MySQLdb cursor object
+
+    Server-side (streaming) cursor types get their own connection, so other
+    queries can be done while the results are still being read"""
     counter = 0
     cache = {}
 
     def __init__(self, cursortype=MySQLdb.cursors.DictCursor, lock=None):
         threadid = threading.current_thread().ident
+        if (issubclass(cursortype, MySQLdb.cursors.CursorUseResultMixIn)):
+            threadid = (threadid, "stream")
         if (threadid in self.cache):
             self.conn = self.cache[threadid]
             self.conn.ping(True)
@@ -70,6 +63,17 @@ class MySQLCursor(object):
         return
 
 MySQLNormalCursor = functools.partial(MySQLCursor, cursortype=MySQLdb.cursors.Cursor)
+MySQLStreamCursor = functools.partial(MySQLCursor, cursortype=MySQLdb.cursors.SSDictCursor)
+
+
+def songdelay(requestcount):
+    """Returns the amount of seconds a song with `requestcount` can't be
+    requested for after it was played or requested"""
+    requestcount = min(requestcount, 30)
+
+    if 0 <= requestcount <= 7:
+        return -11057 * requestcount ** 2 + 172954 * requestcount + 81720
+    return int(599955 * math.exp(0.0372 * requestcount) + 0.5)
 
 
 def get_hms(seconds):
@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+import time
+import atexit
+import logging
+import threading
+import collections
+
+from .util import MySQLCursor
+import bootstrap
+
+
+class Batch(object):
+    """A list of statements that are executed in a single transaction.
+
+    It has the `execute` method of a cursor and can be used as a context
+    manager, so code written against a MySQLCursor can fill a batch instead.
+    """
+    def __init__(self):
+        super(Batch, self).__init__()
+        self.statements = []
+
+    def execute(self, query, args=None):
+        self.statements.append((query, args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return
+
+    def __len__(self):
+        return len(self.statements)
+
+
+class Writer(object):
+    """Write-behind queue for database writes nobody has to wait on.
+
+    Batches are executed in order by a background thread, each in its own
+    transaction. Batches submitted with a key replace a pending batch with
+    the same key, and are dropped when they are identical to the last batch
+    written with that key, so only use a key for state no other process
+    writes. A batch that fails is tried again up to `retries` times, waiting
+    `backoff` seconds doubled for every attempt, before it is dropped.
+    Everything pending is written on interpreter exit or when `flush` is
+    called.
+    """
+    __metaclass__ = bootstrap.Singleton
+    retries = 3
+    backoff = 1
+
+    def __init__(self):
+        super(Writer, self).__init__()
+        self.condition = threading.Condition()
+        self.executing = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.written = {}
+        self.counter = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name="Database Writer")
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, batch, key=None):
+        """Queues `batch` for writing, see the class docstring for `key`"""
+        if (len(batch) == 0):
+            return
+        with self.condition:
+            if (key is None):
+                self.counter += 1
+                slot = ("unkeyed", self.counter)
+            elif (self.written.get(key) == batch.statements
+                  and ("keyed", key) not in self.pending):
+                return
+            else:
+                slot = ("keyed", key)
+            self.pending.pop(slot, None)
+            self.pending[slot] = (key, batch)
+            self.condition.notify()
+
+    def run(self):
+        logging.info("THREADING: Started database writer")
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            self.flush()
+
+    def flush(self):
+        """Writes all pending batches in the calling thread"""
+        with self.executing:
+            while True:
+                with self.condition:
+                    if (not self.pending):
+                        return
+                    slot, (key, batch) = self.pending.popitem(last=False)
+                if self.retry(batch) and (key is not None):
+                    self.written[key] = batch.statements
+
+    def retry(self, batch):
+        """Writes `batch`, trying again when it fails. Batches after it
+        wait, so the order of the writes is kept. Returns True on success"""
+        for attempt in xrange(self.retries + 1):
+            if (attempt):
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            if self.write(batch):
+                return True
+        logging.error("Database writer dropped a batch after %d attempts: %r",
+                      self.retries + 1, batch.statements)
+        return False
+
+    @staticmethod
+    def write(batch):
+        """Executes `batch` as a single transaction, a failing statement
+        rolls back the whole batch. Returns True on success"""
+        try:
+            conn = MySQLCursor().conn
+            cur = conn.cursor()
+        except:
+            logging.exception("Database writer can't connect")
+            return False
+        try:
+            for query, args in batch.statements:
+                cur.execute(query, args)
+        except:
+            try:
+                conn.rollback()
+            except:
+                pass
+            logging.exception("Database writer failed on batch")
+            return False
+        else:
+            conn.commit()
+            return True
+        finally:
+            cur.close()
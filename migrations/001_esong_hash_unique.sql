@@ -0,0 +1,31 @@
+-- Adds the UNIQUE index on esong.hash that Song.get_songid relies on to
+-- insert a row with INSERT ... ON DUPLICATE KEY UPDATE.
+--
+-- Run it once, with the streamer and the IRC bot stopped:
+--
+--     mysql <database> < migrations/001_esong_hash_unique.sql
+--
+-- Rows with the same hash are merged into the oldest one first, their
+-- faves and plays are moved over.
+
+CREATE TEMPORARY TABLE `esong_duplicates` AS
+    SELECT `esong`.`id` AS `id`, `oldest`.`id` AS `keep`
+    FROM `esong` JOIN (SELECT `hash`, MIN(`id`) AS `id` FROM `esong`
+                       GROUP BY `hash` HAVING COUNT(*) > 1) AS `oldest`
+    ON `esong`.`hash` = `oldest`.`hash` AND `esong`.`id` != `oldest`.`id`;
+
+-- Faves the oldest row already has would be doubled
+DELETE `efave` FROM `efave` JOIN `esong_duplicates`
+    ON `efave`.`isong` = `esong_duplicates`.`id`
+    JOIN `efave` AS `kept` ON `kept`.`isong` = `esong_duplicates`.`keep`
+    AND `kept`.`inick` = `efave`.`inick`;
+UPDATE `efave` JOIN `esong_duplicates` ON `efave`.`isong` = `esong_duplicates`.`id`
+    SET `efave`.`isong` = `esong_duplicates`.`keep`;
+UPDATE `eplay` JOIN `esong_duplicates` ON `eplay`.`isong` = `esong_duplicates`.`id`
+    SET `eplay`.`isong` = `esong_duplicates`.`keep`;
+DELETE `esong` FROM `esong` JOIN `esong_duplicates`
+    ON `esong`.`id` = `esong_duplicates`.`id`;
+
+DROP TEMPORARY TABLE `esong_duplicates`;
+
+ALTER TABLE `esong` ADD UNIQUE INDEX `hash_unique` (`hash`);
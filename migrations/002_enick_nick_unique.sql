@@ -0,0 +1,30 @@
+-- Adds the UNIQUE index on enick.nick that get_nickids in manager/song.py
+-- relies on to create nicknames with INSERT IGNORE.
+--
+-- Run it once, with the streamer and the IRC bot stopped:
+--
+--     mysql <database> < migrations/002_enick_nick_unique.sql
+--
+-- Nicknames that exist more than once are merged into the oldest row
+-- first and their faves are moved over. The other columns of the newer
+-- rows, like authcode, are dropped.
+
+CREATE TEMPORARY TABLE `enick_duplicates` AS
+    SELECT `enick`.`id` AS `id`, `oldest`.`id` AS `keep`
+    FROM `enick` JOIN (SELECT `nick`, MIN(`id`) AS `id` FROM `enick`
+                       GROUP BY `nick` HAVING COUNT(*) > 1) AS `oldest`
+    ON `enick`.`nick` = `oldest`.`nick` AND `enick`.`id` != `oldest`.`id`;
+
+-- Faves the oldest row already has would be doubled
+DELETE `efave` FROM `efave` JOIN `enick_duplicates`
+    ON `efave`.`inick` = `enick_duplicates`.`id`
+    JOIN `efave` AS `kept` ON `kept`.`inick` = `enick_duplicates`.`keep`
+    AND `kept`.`isong` = `efave`.`isong`;
+UPDATE `efave` JOIN `enick_duplicates` ON `efave`.`inick` = `enick_duplicates`.`id`
+    SET `efave`.`inick` = `enick_duplicates`.`keep`;
+DELETE `enick` FROM `enick` JOIN `enick_duplicates`
+    ON `enick`.`id` = `enick_duplicates`.`id`;
+
+DROP TEMPORARY TABLE `enick_duplicates`;
+
+ALTER TABLE `enick` ADD UNIQUE INDEX `nick_unique` (`nick`);
@@ -0,0 +1,34 @@
+-- Adds the category column playerstats.py stores the classified player
+-- of every listener in, and classifies the rows already in the table.
+-- The CASE follows the categories in playerstats.py, in the same order.
+--
+-- Run it once, with the scheduler stopped:
+--
+--     mysql <database> < migrations/003_playerstats_category.sql
+
+ALTER TABLE `playerstats` ADD COLUMN `category` VARCHAR(16) NULL,
+    ADD INDEX (`category`);
+
+UPDATE `playerstats` SET `category` = CASE
+    WHEN LOWER(`player`) LIKE '%foobar%' THEN 'Foobar'
+    WHEN LOWER(`player`) LIKE '%winampmpeg%' THEN 'WinAmp'
+    WHEN LOWER(`player`) LIKE '%itunes%' THEN 'iTunes'
+    WHEN LOWER(`player`) LIKE '%nsplayer%' THEN 'WMP'
+    WHEN LOWER(`player`) LIKE '%mplayer%' THEN 'MPlayer'
+    WHEN LOWER(`player`) LIKE '%videolan%'
+        OR LOWER(`player`) LIKE '%vlc%' THEN 'VLC'
+    WHEN LOWER(`player`) LIKE '%android%'
+        OR LOWER(`player`) LIKE '%iphone%' THEN 'Mobile phone'
+    WHEN LOWER(`player`) LIKE '%msie 7.0%'
+        AND LOWER(`player`) LIKE '%.net clr%' THEN 'MPC'
+    WHEN LOWER(`player`) LIKE '%firefox%'
+        OR LOWER(`player`) LIKE '%trident%'
+        OR LOWER(`player`) LIKE '%opera%'
+        OR LOWER(`player`) LIKE '%safari%'
+        OR LOWER(`player`) LIKE '%chrome%'
+        OR LOWER(`player`) LIKE '%chromium%' THEN 'Web player'
+    WHEN LOWER(`player`) LIKE '%hanyuu-sama%'
+        OR LOWER(`player`) LIKE '%icecast%'
+        OR LOWER(`player`) LIKE '%shoutcast%' THEN 'Ignored'
+    ELSE 'Other' END
+WHERE `category` IS NULL;
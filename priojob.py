@@ -1,6 +1,28 @@
 import manager
 
-with manager.MySQLCursor() as cur:
-    #cur.execute("UPDATE `tracks` SET `priority`=GREATEST(0, priority-1);")
-    cur.execute("UPDATE `tracks` SET `requestcount`=IF(UNIX_TIMESTAMP(NOW())-UNIX_TIMESTAMP(lastrequested) > 3600*24*13, greatest(requestcount - 1, 0), requestcount);")
+# Rows updated per statement, each chunk is its own transaction
+chunk_size = 500
 
+
+def run():
+    """Lowers the requestcount of tracks not requested for 13 days.
+
+    Only the tracks that actually change are selected first and then
+    updated in chunks, so the request path never waits on a lock of the
+    whole table."""
+    with manager.MySQLNormalCursor() as cur:
+        #cur.execute("UPDATE `tracks` SET `priority`=GREATEST(0, priority-1);")
+        cur.execute("SELECT id FROM `tracks` WHERE requestcount > 0 AND \
+        lastrequested < NOW() - INTERVAL 13 DAY;")
+        ids = [trackid for trackid, in cur]
+    for start in xrange(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        with manager.MySQLNormalCursor() as cur:
+            # The track might have been requested since the select
+            cur.execute("UPDATE `tracks` SET requestcount=requestcount - 1 \
+            WHERE id IN ({0}) AND requestcount > 0 AND \
+            lastrequested < NOW() - INTERVAL 13 DAY;".format(
+                ", ".join(["%s"] * len(chunk))), chunk)
+
+if __name__ == "__main__":
+    run()
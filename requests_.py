@@ -18,18 +18,11 @@ debug = True
 def songdelay(val):
     """Gives the time delay in seconds for a specific song
     request count.
+
+    .. deprecated:: 1.2
+       use :func:`manager.songdelay` instead.
     """
-    import math
-    if val > 30:
-        val = 30
-    # return int(29145 * math.exp(0.0476 * val) + 0.5)
-    # return int(0.1791*val**4 - 17.184*val**3 + 557.07*val**2 - 3238.9*val + 30687 + 0.5)
-    # return int(25133*math.exp(0.1625*val)+0.5)
-    # return int(-123.82*val**3 + 3355.2*val**2 + 10110*val + 51584 + 0.5)
-    if 0 <= val <= 7:
-        return -11057 * val ** 2 + 172954 * val + 81720
-    else:
-        return int(599955 * math.exp(0.0372 * val) + 0.5)
+    return manager.songdelay(val)
 
 
 def check_hmac(value, hash):
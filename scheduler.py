@@ -0,0 +1,152 @@
+import time
+import random
+import logging
+import threading
+
+import bootstrap
+import config
+
+
+class Job(object):
+    """A function that is run every `interval` seconds by the Scheduler.
+
+    Every wait is shortened or lengthened by up to `jitter` seconds so jobs
+    with the same interval don't all hit the database at once. The job runs
+    in its own thread, so a run that takes longer than the interval delays
+    the next run instead of overlapping it; such runs are counted in
+    `overruns`.
+    """
+    def __init__(self, name, function, interval, jitter=None):
+        super(Job, self).__init__()
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.jitter = interval * 0.1 if jitter is None else jitter
+        self.thread = None
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.last_run = 0
+        self.last_duration = 0
+        self.max_duration = 0
+        self.total_duration = 0
+
+    def run(self):
+        """Runs the job once and records how long it took"""
+        start = time.time()
+        try:
+            self.function()
+        except:
+            self.failures += 1
+            logging.exception("Scheduled job %s failed", self.name)
+        duration = time.time() - start
+        self.runs += 1
+        self.last_run = start
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+        if (duration > self.interval):
+            self.overruns += 1
+            logging.warning("Scheduled job %s took %.1f seconds, longer "
+                            "than its interval", self.name, duration)
+
+    def loop(self, event):
+        logging.info("THREADING: Starting scheduled job %s", self.name)
+        # Don't start everything at the same moment either
+        event.wait(random.uniform(0, self.jitter))
+        while not event.is_set():
+            start = time.time()
+            self.run()
+            wait = self.interval + random.uniform(-self.jitter, self.jitter)
+            event.wait(max(wait - (time.time() - start), 0))
+        logging.info("THREADING: Stopping scheduled job %s", self.name)
+
+    def stats(self):
+        return {"runs": self.runs,
+                "failures": self.failures,
+                "overruns": self.overruns,
+                "last_run": self.last_run,
+                "last_duration": self.last_duration,
+                "max_duration": self.max_duration,
+                "average_duration": (self.total_duration / self.runs
+                                     if self.runs else 0)}
+
+
+class Scheduler(object):
+    """Runs the periodic maintenance jobs in a single long running process.
+
+    Each job runs on its own thread and keeps that thread's database
+    connection between runs, instead of paying for a new interpreter, the
+    manager import and a new connection every time cron starts a script.
+    """
+    __metaclass__ = bootstrap.Singleton
+
+    def __init__(self):
+        super(Scheduler, self).__init__()
+        self.jobs = {}
+        self.event = threading.Event()
+
+    def register(self, name, function, interval, jitter=None):
+        """Registers `function` to be called every `interval` seconds,
+        see Job"""
+        job = Job(name, function, interval, jitter)
+        self.jobs[name] = job
+        if (self.started):
+            self.start_job(job)
+        return job
+
+    @property
+    def started(self):
+        return any(job.thread is not None for job in self.jobs.itervalues())
+
+    def start(self):
+        self.event.clear()
+        for job in self.jobs.itervalues():
+            self.start_job(job)
+
+    def start_job(self, job):
+        job.thread = threading.Thread(name="Scheduled Job " + job.name,
+                                      target=job.loop, args=(self.event,))
+        job.thread.daemon = 1
+        job.thread.start()
+
+    def stop(self):
+        self.event.set()
+        for job in self.jobs.itervalues():
+            if (job.thread is not None):
+                job.thread.join(10)
+                job.thread = None
+
+    def stats(self):
+        """Returns a dict of job name -> dict of runtime statistics"""
+        return dict((name, job.stats()) for name, job
+                    in self.jobs.iteritems())
+
+
+def register_jobs():
+    import listenerjob
+    import priojob
+    import playerstats
+    scheduler = Scheduler()
+    scheduler.register("listenerjob", listenerjob.run,
+                       getattr(config, "listenerjob_interval", 60))
+    scheduler.register("priojob", priojob.run,
+                       getattr(config, "priojob_interval", 24 * 3600))
+    scheduler.register("playerstats", playerstats.run,
+                       getattr(config, "playerstats_interval", 3600))
+    return scheduler
+
+
+def main():
+    bootstrap.logging_setup()
+    scheduler = register_jobs()
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(3600)
+            logging.info("Scheduled jobs: %r", scheduler.stats())
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+if __name__ == "__main__":
+    main()
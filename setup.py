@@ -22,6 +22,7 @@ setup(
         "MySQL-python >= 1.2.3",
         "xmltodict >= 0.4",
         "raven",
+        "numpy >= 1.6",
         #"audiotools >= 2.19alpha3",
     ],
     keywords = "streaming icecast fastcgi irc",
@@ -5,26 +5,95 @@ import config
 import manager
 import json
 import itertools
+import codecs
+import collections
+import time
+import threading
+import urlparse
+from multiprocessing.pool import ThreadPool, TimeoutError
 from bootstrap import Switch
 
 dns_spamfilter = Switch(True)  # 15 second resetting spamfilter
 timeout = {}
 error_regex = re.compile("<b>(?P<err>[a-z ]+)<\/b>", re.IGNORECASE)
 
+# Last good status of each relay, url -> (time, stats)
+relay_status = {}
+# Statuses older than this are not used for the listener count
+relay_status_timeout = 60
+# Fetches the relays concurrently, one thread per relay
+pool = None
+pool_size = 0
+pool_lock = threading.Lock()
+
+
+def relays():
+    """Returns the status urls of the relays, the first is the master"""
+    return getattr(config, "icecast_relays", [config.icecast_status])
+
+
 def get_status(server_name):
     """
     Gets the current status of the master server, and the listener counts of all of the
     slave relays, aggregating them, filtering negative, and summing them to give an
     artificial Master server listener count used by Hanyuu in every StatusUpdate call.
+
+    The relays are fetched concurrently, a slave relay that doesn't answer
+    within `config.icecast_timeout` seconds is counted with its last good
+    status of the past minute.
     """
-    result = {"online": False}
+    global pool, pool_size
+    urls = relays()
+    timeout = getattr(config, "icecast_timeout", 2)
+    with pool_lock:
+        if pool is None or pool_size < len(urls):
+            # Relays got added, let the old pool finish its work and go
+            if pool is not None:
+                pool.close()
+            pool = ThreadPool(len(urls))
+            pool_size = len(urls)
+        pending = [(url, pool.apply_async(fetch_status, (url, timeout)))
+                   for url in urls]
+    deadline = time.time() + timeout + 0.5
+    now = time.time()
+    results = []
+    for url, pending_result in pending:
+        try:
+            stats = pending_result.get(max(deadline - time.time(), 0))
+        except TimeoutError:
+            logging.warning("Relay {} is too slow".format(url))
+            stats = None
+        if stats is not None:
+            relay_status[url] = (now, stats)
+        elif url != urls[0]:
+            fetched, stats = relay_status.get(url, (0, None))
+            if now - fetched > relay_status_timeout:
+                stats = None
+        results.append(stats)
+
+    # Only the master decides if the stream is online
+    master = results[0]
+    if not master or not master.get("online", False):
+        return {"online": False}
+    result = dict(master)
+    for key in ("listeners", "peak_listeners"):
+        result[key] = sum(max(int(stats.get(key, 0) or 0), 0)
+                          for stats in results
+                          if stats and stats.get("online", False))
+    return result
+
+
+def fetch_status(url, timeout=2):
+    """Returns the mount stats of the relay at `url`, or None if it
+    couldn't be fetched. An offline mount is {"online": False}"""
     try:
-            response = requests.get(
-                config.icecast_status,
+            response = manager.HTTPClient().get(
+                url,
+                endpoint="icecast status " + urlparse.urlsplit(url).netloc,
                 headers={
                     'User-Agent': 'Mozilla'
                 },
-                timeout=2
+                timeout=timeout
             )
     except requests.HTTPError as e:  # rare, mostly 403
         if not dns_spamfilter:
@@ -34,14 +103,13 @@ def get_status(server_name):
         else:
             logging.exception("HTTPError occured in status retrieval")
     except requests.ConnectionError:
-        logging.exception("Connection interrupted to master server")
+        logging.exception("Connection interrupted to {}".format(url))
     except:
         logging.exception(
-            "Can't connect to master status page. Is Icecast running?")
+            "Can't connect to status page {}. Is Icecast running?".format(url))
     else:
-            result = parse_status(response)  # bytestring
-
-    return result
+        return parse_status(response)  # bytestring
+    return None
 
 
 def parse_status(result):
@@ -65,26 +133,61 @@ def parse_status(result):
 
 
 
-def parse_listeners(result):
-    clients = icecast_json(result)
-    results = []
+class Listener(collections.namedtuple("Listener", "ip player time")):
+    __slots__ = ()
 
-    if clients and clients.get(config.icecast_mount, False):
-        for listener in clients.get(config.icecast_mount, False):
-            results.append({
-                "ip": listener["ip"],
-                "player": listener["user_agent"],
-                "time": listener["connected_seconds"],
-            })
 
-    return results
+def parse_listeners(result, chunk_size=16384):
+    """
+    Yields a Listener for every listener of our mount in the streamed
+    response `result`. Only the listener being decoded is kept in memory
+    instead of the whole document.
+    """
+    if result.status_code != 200:
+        icecast_json(result)  # logs the error
+        return
+
+    # The listener array of our mount, nested in "mounts" or not
+    start = re.compile(r'{0}\s*:\s*\['.format(
+        re.escape(json.dumps(config.icecast_mount))))
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")("replace")
+    chunks = result.iter_content(chunk_size)
+    buffer = u""
+    found = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        if not found:
+            match = start.search(buffer)
+            if not match:
+                # Keep enough for a key split over two chunks
+                buffer = buffer[-256:]
+                continue
+            buffer = buffer[match.end():]
+            found = True
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in u" \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == u"]":
+                return
+            try:
+                listener, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The object continues in the next chunk
+                break
+            yield Listener(listener["ip"], listener["user_agent"],
+                           listener["connected_seconds"])
+        buffer = buffer[position:]
+
 
 def get_listeners():
     """
-    Used by player_stats (internal) to generate listener statistics and graphs
+    Used by player_stats (internal) to generate listener statistics and graphs,
+    yields a Listener for every listener
     """
     try:
-        result = requests.get(
+        result = manager.HTTPClient().get(
             '{url}/admin/listeners.json?mount={mount}'.format(
                 url=config.icecast_server,
                 mount=config.icecast_mount
@@ -94,13 +197,19 @@ def get_listeners():
                 'Referer': '{url}/admin/'.format(url=config.icecast_server),
                 'Authorization': 'Basic {}'.format(config.stream_admin_auth)
             },
-            timeout=2)
+            timeout=2,
+            stream=True,
+            endpoint="icecast listeners")
     except:
         logging.exception("get_listeners")
-    else:
-        listeners.extend(list(parse_listeners(result)))
-
-        
+        return
+    try:
+        for listener in parse_listeners(result):
+            yield listener
+    except:
+        logging.exception("get_listeners")
+    finally:
+        result.close()
 
 
 def icecast_json(result):
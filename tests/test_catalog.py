@@ -0,0 +1,124 @@
+"""
+Tests of the in-memory requestability index in manager/catalog.py, with
+the rows stored directly instead of loaded from the database. Run them
+from the top directory with
+
+    python -m unittest discover tests
+"""
+import time
+import unittest
+
+from manager import catalog, util
+
+
+class CatalogTest(unittest.TestCase):
+    now = 1400000000
+
+    def setUp(self):
+        self.catalog = catalog.Catalog()
+        self.catalog.clear()
+        # Keeps the catalog from loading from the database
+        self.catalog.reloaded = self.catalog.refreshed = time.time()
+        # (id, usable, lastplayed, lastrequested, requestcount, priority)
+        self.catalog.store([(1, 1, 0, 0, 0, 0),
+                            (2, 1, self.now - 100, 0, 0, 0),
+                            (3, 0, 0, 0, 0, 0),
+                            (4, 1, 0, self.now - 100, 5, 10)])
+
+    def test_songdelays(self):
+        self.assertEqual(list(catalog.songdelays(range(40))),
+                         [util.songdelay(i) for i in range(40)])
+
+    def test_seconds_until_requestable(self):
+        waits = self.catalog.seconds_until_requestable([1, 2, 3, 4, 5],
+                                                       self.now)
+        self.assertEqual(list(waits),
+                         [0, util.songdelay(0) - 100, float("inf"),
+                          util.songdelay(5) - 100, float("inf")])
+
+    def test_touch(self):
+        self.catalog.touch(1, lr=self.now)
+        self.assertEqual(self.catalog.filter([1, 2, 3, 4], self.now), [])
+
+    def test_random(self):
+        self.catalog.store([(2, 1, 0, 0, 0, 0)])
+        self.catalog.touch(4, lr=time.time())
+        for i in range(50):
+            self.assertIn(self.catalog.random(), [1, 2, 3, 4])
+            self.assertIn(self.catalog.random(requestable=True), [1, 2])
+            self.assertIn(self.catalog.random(weight="priority"),
+                          [1, 2, 3, 4])
+
+    def test_random_nothing_requestable(self):
+        self.catalog.clear()
+        self.catalog.store([(3, 0, 0, 0, 0, 0)])
+        self.assertEqual(self.catalog.random(requestable=True), None)
+
+    def test_requestable(self):
+        self.assertEqual(list(self.catalog.requestable([1, 2, 3, 4, 5],
+                                                       self.now)),
+                         [True, False, False, False, False])
+
+    def test_store_replaces(self):
+        self.catalog.store([(3, 1, 0, 0, 0, 0), (6, 1, 0, 0, 0, 0)])
+        self.assertEqual(self.catalog.filter([1, 2, 3, 4, 6], self.now),
+                         [1, 3, 6])
+        self.assertEqual(len(self.catalog.ids), 5)
+        self.assertEqual(self.catalog.max_id, 6)
+
+    def test_positions(self):
+        self.assertEqual(list(self.catalog.positions([4, 9, 1])),
+                         [3, -1, 0])
+
+
+class Cursor(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def execute(self, query, args=None):
+        self.queries.append((" ".join(query.split()), args))
+
+    def fetchall(self):
+        return self.rows
+
+
+class CatalogLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.cursor = catalog.MySQLNormalCursor
+        self.catalog = catalog.Catalog()
+        self.catalog.clear()
+        self.catalog.reloaded = self.catalog.refreshed = 0
+
+    def tearDown(self):
+        catalog.MySQLNormalCursor = self.cursor
+
+    def test_reload_then_refresh(self):
+        catalog.MySQLNormalCursor = cursor = Cursor([(1, 1, 0, 0, 0, 0),
+                                                     (2, 1, 0, 0, 0, 0)])
+        self.assertEqual(self.catalog.filter([1, 2, 3]), [1, 2])
+        self.assertTrue(self.catalog.loaded)
+
+        cursor.rows = [(3, 1, 0, 0, 0, 0)]
+        self.catalog.refreshed -= self.catalog.refresh + 1
+        self.assertEqual(self.catalog.filter([1, 2, 3]), [1, 2, 3])
+        query, args = cursor.queries[-1]
+        self.assertIn("WHERE id > %s", query)
+        self.assertEqual(args[0], 2)
+
+        # Nothing is due, no query
+        self.catalog.filter([1])
+        self.assertEqual(len(cursor.queries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests of requesting the first requestable of several tracks, as done by
+!random and !lucky, against an in-memory stand-in for the tracks table.
+Run them from the top directory with
+
+    python -m unittest discover tests
+"""
+import time
+import unittest
+
+import manager
+from bot import hanyuu_commands
+
+
+class Cursor(object):
+    """Answers the hostmask and the tracks query of nick_request_songs"""
+    def __init__(self, tracks, afk=1, requested=None):
+        self.tracks = tracks
+        self.afk = afk
+        self.requested = requested
+        self.updates = []
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def execute(self, query, args=None):
+        self.args = args
+        if query.startswith(("UPDATE", "INSERT")):
+            self.updates.append((query, args))
+
+    def fetchone(self):
+        return {"id": None, "timestamp": self.requested, "afk": self.afk}
+
+    def __iter__(self):
+        return iter([self.tracks[trackid] for trackid in self.args
+                     if trackid in self.tracks])
+
+
+class Song(object):
+    def __init__(self, id):
+        self.id = id
+
+    def update_index(self):
+        pass
+
+
+class NickRequestSongsTest(unittest.TestCase):
+    def setUp(self):
+        now = time.time()
+        self.tracks = dict((row["id"], row) for row in [
+            dict(id=1, usable=1, lp=now - 100, lr=0, requestcount=0,
+                 priority=0),
+            dict(id=2, usable=0, lp=0, lr=0, requestcount=0, priority=0),
+            dict(id=3, usable=1, lp=0, lr=0, requestcount=3, priority=0)])
+        self.cursor = Cursor(self.tracks)
+        self.originals = manager.MySQLCursor, manager.Song
+        manager.MySQLCursor = self.cursor
+        manager.Song = Song
+        self.catalog = manager.Catalog()
+        self.catalog.clear()
+        # Keeps the catalog from loading from the database
+        self.catalog.reloaded = self.catalog.refreshed = now
+
+    def tearDown(self):
+        manager.MySQLCursor, manager.Song = self.originals
+
+    def request(self, trackids):
+        return hanyuu_commands.nick_request_songs(trackids, "host")
+
+    def test_first_requestable(self):
+        song = self.request([9, 1, 2, 3])
+        self.assertEqual(song.id, 3)
+        self.assertEqual(self.catalog.requestcount[self.catalog.index[3]], 5)
+        self.assertFalse(self.catalog.requestable([3])[0])
+
+    def test_waiting(self):
+        response, delay = self.request([1, 2])
+        self.assertEqual(response, 4)
+        self.assertTrue(0 < delay <= manager.songdelay(0))
+        self.assertEqual(self.cursor.updates, [])
+
+    def test_unusable(self):
+        self.assertEqual(self.request([2, 9]), (5, 0))
+
+    def test_missing(self):
+        self.assertEqual(self.request([8, 9]), 1)
+        self.assertEqual(self.request([]), 1)
+
+    def test_hostmask_waits(self):
+        self.cursor.requested = int(time.time()) - 600
+        response, delay = self.request([3])
+        self.assertEqual(response, 2)
+        self.assertTrue(2990 <= delay <= 3000)
+
+    def test_not_afk(self):
+        self.cursor.afk = 0
+        self.assertEqual(self.request([3]), (3, 0))
+
+    def test_request_first_messages(self):
+        empty = u"There are no songs that can be requested right now"
+        self.assertEqual(hanyuu_commands.request_first(None, [], "host",
+                                                       empty), empty)
+        self.assertEqual(hanyuu_commands.request_first(None, [9], "host",
+                                                       empty), empty)
+        self.assertEqual(hanyuu_commands.request_first(None, [2], "host"),
+                         hanyuu_commands.hanyuu_response(5, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests of the player classification and the category column check of
+playerstats.py. Run them from the top directory with
+
+    python -m unittest discover tests
+"""
+import unittest
+
+import manager
+import playerstats
+
+
+class Cursor(object):
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+        self.queries = []
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def execute(self, query, args=None):
+        self.queries.append(query)
+
+
+class ClassifyTest(unittest.TestCase):
+    def setUp(self):
+        playerstats.classified.clear()
+
+    def test_categories(self):
+        for player, category in [
+                ("foobar2000/1.1", "Foobar"),
+                ("WinampMPEG/5.0", "WinAmp"),
+                ("iTunes/11.0 (Macintosh)", "iTunes"),
+                ("NSPlayer/12.0", "WMP"),
+                ("MPlayer 1.0", "MPlayer"),
+                ("VLC/2.0.5 LibVLC/2.0.5", "VLC"),
+                ("Mozilla/5.0 (Linux; Android 4.2) Chrome/30", "Mobile phone"),
+                ("Mozilla/4.0 (MSIE 7.0; .NET CLR 2.0)", "MPC"),
+                ("Mozilla/4.0 (MSIE 7.0)", "Other"),
+                ("Mozilla/5.0 Firefox/25.0", "Web player"),
+                ("Icecast 2.3.3", "Ignored"),
+                ("", "Other")]:
+            self.assertEqual(playerstats.classify(player), category)
+
+    def test_precedence(self):
+        self.assertEqual(playerstats.classify("VLC foobar2000"), "Foobar")
+
+
+class CheckColumnTest(unittest.TestCase):
+    def setUp(self):
+        self.cursor = manager.MySQLNormalCursor
+        playerstats.column_checked = False
+
+    def tearDown(self):
+        manager.MySQLNormalCursor = self.cursor
+        playerstats.column_checked = False
+
+    def test_missing(self):
+        manager.MySQLNormalCursor = cursor = Cursor(0)
+        self.assertRaises(RuntimeError, playerstats.check_column)
+        self.assertRaises(RuntimeError, playerstats.check_column)
+        self.assertEqual(len(cursor.queries), 2)
+
+    def test_checked_once(self):
+        manager.MySQLNormalCursor = cursor = Cursor(1)
+        playerstats.check_column()
+        playerstats.check_column()
+        self.assertEqual(len(cursor.queries), 1)
+        self.assertFalse(any(query.startswith("ALTER")
+                             for query in cursor.queries))
+
+
+if __name__ == "__main__":
+    unittest.main()
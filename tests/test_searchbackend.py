@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the in-process search backend in manager/searchbackend.py, with
+the index filled directly instead of from the database. Run them from the
+top directory with
+
+    python -m unittest discover tests
+"""
+import time
+import unittest
+
+from manager import searchbackend
+
+
+class LocalBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = searchbackend.LocalBackend()
+        self.backend.clear()
+        # Keeps the index from loading from the database
+        self.backend.loaded = time.time()
+        for row in [(1, u"Perfume", u"Polyrhythm", u"GAME", u"", 3),
+                    (2, u"Perfume", u"Chocolate Disco", u"GAME", u"", 10),
+                    (3, u"supercell", u"Kimi no Shiranai Monogatari",
+                     u"", u"bakemonogatari", 1),
+                    (4, u"初音ミク", u"Melt", u"", u"", 0)]:
+            self.backend.add(*row)
+        self.backend.tokens.sort()
+
+    def search(self, query):
+        return [document["id"] for document in self.backend.search(query)]
+
+    def test_ranked_by_requests(self):
+        self.assertEqual(self.search(u"perfume"), [2, 1])
+
+    def test_every_word_matches(self):
+        self.assertEqual(self.search(u"perfume poly"), [1])
+        self.assertEqual(self.search(u"perfume melt"), [])
+
+    def test_prefix(self):
+        self.assertEqual(self.search(u"perf"), [2, 1])
+
+    def test_fuzzy(self):
+        self.assertEqual(self.search(u"supercel monogatary"), [3])
+
+    def test_unicode(self):
+        self.assertEqual(self.search(u"初音ミク"), [4])
+
+    def test_empty(self):
+        self.assertEqual(self.search(u"!!"), [])
+
+    def test_replaced(self):
+        self.backend.remove(1)
+        self.backend.add(1, u"Perfume", u"Edge", u"GAME", u"", 30,
+                         insort=True)
+        self.assertEqual(self.search(u"polyrhythm"), [])
+        self.assertEqual(self.search(u"edge"), [1])
+        self.assertEqual(self.search(u"perfume"), [1, 2])
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(searchbackend.tokenize(u"Kimi no  Shiranai!!"),
+                         [u"kimi", u"no", u"shiranai"])
+
+    def test_trigrams(self):
+        self.assertEqual(searchbackend.trigrams(u"melt"),
+                         set([u"  m", u" me", u"mel", u"elt"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
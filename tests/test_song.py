@@ -0,0 +1,156 @@
+"""
+Tests of Faves and get_nickids against an in-memory stand-in for the
+enick and efave tables. Run them from the top directory with
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from manager import song
+
+
+class Database(object):
+    """The few queries on enick and efave that manager.song does"""
+    def __init__(self, nicks, faves, unique=True):
+        # [(id, nick)], set of (inick, isong)
+        self.enick = list(nicks)
+        self.efave = set(faves)
+        self.unique = unique
+        self.queries = []
+
+    def nickids(self, nick):
+        return [nickid for nickid, name in self.enick
+                if name.lower() == nick.lower()]
+
+    def cursor(self, *args, **kwargs):
+        return Cursor(self)
+
+
+class Cursor(object):
+    def __init__(self, database):
+        self.database = database
+        self.rows = []
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def execute(self, query, args=()):
+        database = self.database
+        query = " ".join(query.split())
+        database.queries.append(query)
+        self.rows = []
+        if query.startswith("SHOW INDEX"):
+            self.rowcount = int(database.unique)
+        elif query.startswith("SELECT nick, id FROM enick"):
+            wanted = set(nick.lower() for nick in args)
+            self.rows = sorted(((nick, nickid) for nickid, nick
+                                in database.enick if nick.lower() in wanted),
+                               key=lambda row: row[1])
+        elif query.startswith(("INSERT INTO enick",
+                               "INSERT IGNORE INTO enick")):
+            for nick in args:
+                if database.unique and database.nickids(nick):
+                    continue
+                database.enick.append((len(database.enick) + 1, nick))
+        elif query.startswith("SELECT enick.nick FROM efave"):
+            self.rows = [(nick,) for nickid, nick in database.enick
+                         if (nickid, args[0]) in database.efave]
+        elif query.startswith("INSERT INTO efave"):
+            database.efave.update(zip(args[::2], args[1::2]))
+        elif query.startswith("DELETE efave FROM efave JOIN enick"):
+            for nick in args[1:]:
+                for nickid in database.nickids(nick):
+                    database.efave.discard((nickid, args[0]))
+        elif not query.startswith("UPDATE `tracks`"):
+            raise AssertionError("Unexpected query " + query)
+
+
+class Song(object):
+    def __init__(self, songid):
+        self.id = 0
+        self.songid = songid
+        self.digest = str(songid)
+        self.faves = song.Faves(self)
+
+
+class FavesTest(unittest.TestCase):
+    def setUp(self):
+        self.database = Database([(1, u"alice"), (2, u"Bob")],
+                                 [(1, 10), (2, 10)])
+        self.cursors = song.MySQLCursor, song.MySQLNormalCursor
+        song.MySQLCursor = song.MySQLNormalCursor = self.database.cursor
+        song._nickid_cache.clear()
+        for key in song.unique_indexes:
+            song.unique_indexes[key] = None
+        self.song = Song(10)
+        self.other = Song(11)
+
+    def tearDown(self):
+        song.MySQLCursor, song.MySQLNormalCursor = self.cursors
+        song._nickid_cache.clear()
+        for key in song.unique_indexes:
+            song.unique_indexes[key] = None
+
+    def queries(self, prefix):
+        return [query for query in self.database.queries
+                if query.startswith(prefix)]
+
+    def test_load(self):
+        self.assertEqual(list(self.song.faves), [u"alice", u"Bob"])
+        self.assertIn("ALICE", self.song.faves)
+        self.assertNotIn(None, self.song.faves)
+        self.assertNotIn(1, self.song.faves)
+
+    def test_extend(self):
+        self.song.faves.extend([u"carol", u"Carol", u"dave", u"ALICE"])
+        self.assertEqual(list(self.song.faves),
+                         [u"alice", u"Bob", u"carol", u"dave"])
+        self.assertEqual(len(self.queries("INSERT INTO efave")), 1)
+        self.assertEqual(len(self.database.efave), 4)
+        self.assertEqual(len(self.database.enick), 4)
+
+    def test_extend_chunks(self):
+        self.song.faves.chunk_size = 2
+        self.song.faves.extend([u"nick{0}".format(i) for i in range(5)])
+        self.assertEqual(len(self.queries("INSERT INTO efave")), 3)
+        self.assertEqual(len(self.song.faves), 7)
+
+    def test_remove(self):
+        self.song.faves.remove(u"BOB")
+        self.assertEqual(list(self.song.faves), [u"alice"])
+        self.assertEqual(self.database.efave, set([(1, 10)]))
+        self.assertRaises(KeyError, self.song.faves.remove, u"bob")
+
+    def test_transfer(self):
+        self.other.faves.append(u"alice")
+        self.song.faves.transfer(self.other)
+        self.assertEqual(list(self.song.faves), [])
+        self.assertEqual(list(self.other.faves), [u"alice", u"Bob"])
+        self.assertEqual(self.database.efave, set([(1, 11), (2, 11)]))
+        self.assertEqual(len(self.queries("DELETE")), 1)
+
+    def test_existing_nick_not_inserted(self):
+        self.database.unique = False
+        self.assertEqual(song.get_nickids([u"Alice", u"erin"]),
+                         {u"Alice": 1, u"erin": 3})
+        self.assertEqual(self.database.nickids(u"alice"), [1])
+
+    def test_remove_duplicate_nick(self):
+        # A nickname added twice before enick.nick had its UNIQUE index
+        self.database.unique = False
+        self.database.enick.append((3, u"Alice"))
+        self.database.efave.add((3, 10))
+        self.song.faves.remove(u"alice")
+        self.assertEqual(self.database.efave, set([(2, 10)]))
+        self.assertEqual(song.get_nickids([u"ALICE"]), {u"ALICE": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Tests of DJMatcher, which matches nicknames against the wildcards in the
+dj file. Run them from the top directory with
+
+    python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+
+import config
+from manager.status import DJMatcher
+
+
+class DJMatcherTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("Hanyuu*!hanyuu-*@Hanyuu-sama\n"
+                    "\n"
+                    "vin!kevin@Vin\n"
+                    "exact@Exact\n")
+        self.matcher = DJMatcher()
+        # Compiled here, so config.djfile isn't used
+        self.matcher.check = lambda: None
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_match(self):
+        self.matcher.regexes = DJMatcher.compile(self.filename)
+        self.assertEqual(self.matcher.match(u"Hanyuu-sama"), u"Hanyuu-sama")
+        self.assertEqual(self.matcher.match(u"hanyuu-bot"), u"Hanyuu-sama")
+        self.assertEqual(self.matcher.match(u"Kevin"), u"Vin")
+        self.assertEqual(self.matcher.match(u"vinny"), u"Vin")
+        self.assertEqual(self.matcher.match(u"exact"), u"Exact")
+        self.assertEqual(self.matcher.match(u"nobody"), None)
+
+    def test_many_lines(self):
+        with open(self.filename, "w") as f:
+            for i in range(DJMatcher.lines_per_regex * 2 + 5):
+                f.write("dj{0}x@DJ {0}\n".format(i))
+        self.matcher.regexes = DJMatcher.compile(self.filename)
+        self.assertEqual(len(self.matcher.regexes), 3)
+        self.assertEqual(self.matcher.match(u"dj184x"), u"DJ 184")
+
+    def test_reload(self):
+        djfile = getattr(config, "djfile", None)
+        config.djfile = self.filename
+        try:
+            matcher = DJMatcher()
+            self.assertEqual(matcher.match(u"exact"), u"Exact")
+            with open(self.filename, "w") as f:
+                f.write("exact@Other\n")
+            # Make sure the mtime differs on filesystems with coarse times
+            os.utime(self.filename, (0, matcher.mtime + 10))
+            self.assertEqual(matcher.match(u"exact"), u"Other")
+        finally:
+            config.djfile = djfile
+
+
+if __name__ == "__main__":
+    unittest.main()
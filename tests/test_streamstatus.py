@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming Icecast listener parser in streamstatus.py. Run
+them from the top directory with
+
+    python -m unittest discover tests
+"""
+import json
+import unittest
+
+import config
+import streamstatus
+
+
+class Response(object):
+    status_code = 200
+
+    def __init__(self, body, size):
+        self.body = body
+        self.size = size
+
+    def iter_content(self, chunk_size):
+        for i in xrange(0, len(self.body), self.size):
+            yield self.body[i:i + self.size]
+
+
+class ParseListenersTest(unittest.TestCase):
+    listeners = [{"ip": "10.0.0.{0}".format(i),
+                  "user_agent": u"VLC ü \"{0}\" ]".format(i),
+                  "connected_seconds": i} for i in range(100)]
+
+    def parse(self, document, size):
+        body = json.dumps(document, indent=1).encode("utf-8")
+        return list(streamstatus.parse_listeners(Response(body, size)))
+
+    def test_chunk_sizes(self):
+        for size in (1, 7, 16384):
+            listeners = self.parse({config.icecast_mount: self.listeners},
+                                   size)
+            self.assertEqual(len(listeners), 100)
+            self.assertEqual(listeners[5], ("10.0.0.5", u"VLC ü \"5\" ]", 5))
+
+    def test_other_mounts(self):
+        document = {"mounts": {"/other": [self.listeners[0]],
+                               config.icecast_mount: self.listeners[1:3]}}
+        self.assertEqual([listener.time for listener
+                          in self.parse(document, 7)], [1, 2])
+
+    def test_no_listeners(self):
+        self.assertEqual(self.parse({config.icecast_mount: []}, 7), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests of the listener time series in manager/timeseries.py, saved to a
+temporary file. Run them from the top directory with
+
+    python -m unittest discover tests
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from manager import timeseries
+
+
+class RingTest(unittest.TestCase):
+    def test_rollover(self):
+        ring = timeseries.Ring(10, 3)
+        ring.add(0, 5, 1)
+        ring.add(5, 7, 1)
+        ring.add(10, 1, 2)
+        ring.add(20, 2, 2)
+        # Reuses the slot of the first interval
+        ring.add(30, 4, 3)
+        slots = ring.select(0, 40)
+        self.assertEqual(list(ring.start[slots]), [10, 20, 30])
+        self.assertEqual(list(ring.peak[slots]), [1, 2, 4])
+        self.assertEqual(list(ring.count[slots]), [1, 1, 1])
+        self.assertEqual(list(ring.dj[slots]), [2, 2, 3])
+
+    def test_average(self):
+        ring = timeseries.Ring(10, 3)
+        ring.add(0, 5, 1)
+        ring.add(5, 7, 1)
+        slot = ring.select(0, 10)[0]
+        self.assertEqual(ring.total[slot] / ring.count[slot], 6)
+        self.assertEqual(ring.peak[slot], 7)
+
+
+class TimeSeriesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.series = timeseries.TimeSeries()
+        self.state = (self.series.filename, self.series.rings,
+                      self.series.writing)
+        self.series.filename = os.path.join(self.directory, "listeners.npz")
+        self.series.rings = [timeseries.Ring(resolution, size)
+                             for resolution, size in self.series.resolutions]
+        self.series.writing = False
+        self.now = time.time() - 3600
+
+    def tearDown(self):
+        (self.series.filename, self.series.rings,
+         self.series.writing) = self.state
+        shutil.rmtree(self.directory)
+
+    def add(self):
+        for i in range(6):
+            self.series.add(10 * i, dj=3, now=self.now + 10 * i)
+
+    def test_query(self):
+        self.add()
+        points = self.series.query(self.now - 60, self.now + 60)
+        self.assertEqual([point[2] for point in points], range(0, 60, 10))
+        self.assertEqual(set(point[3] for point in points), set([3]))
+
+    def test_aggregate(self):
+        self.add()
+        # The hour the counts fall in starts before them
+        result = self.series.aggregate(self.now - 3600, self.now + 60,
+                                       resolution=3600)
+        self.assertEqual(result, {"average": 25.0, "peak": 50,
+                                  "samples": 6})
+
+    def test_reload(self):
+        self.add()
+        self.series.save()
+        self.series.rings = [timeseries.Ring(resolution, size)
+                             for resolution, size in self.series.resolutions]
+        # Only processes that don't add counts read the file again
+        self.series.check()
+        self.assertEqual(self.series.query(self.now - 60, self.now + 60), [])
+        self.series.writing = False
+        self.series.mtime = None
+        self.series.check()
+        self.assertEqual(len(self.series.query(self.now - 60,
+                                               self.now + 60)), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
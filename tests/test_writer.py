@@ -0,0 +1,72 @@
+"""
+Tests of the write-behind queue in manager/writer.py, with Writer.write
+replaced so nothing reaches the database. Run them from the top
+directory with
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from manager import writer
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = writer.Writer()
+        self.writer.flush()
+        self.writer.written.clear()
+        self.writes = []
+        self.failures = 0
+
+        def write(batch):
+            if self.failures:
+                self.failures -= 1
+                return False
+            self.writes.append(batch.statements)
+            return True
+        self.writer.write = write
+        self.writer.backoff = 0
+
+    def tearDown(self):
+        del self.writer.write
+        del self.writer.backoff
+
+    def batch(self, value):
+        batch = writer.Batch()
+        batch.execute("UPDATE `streamstatus` SET `listeners`=%s;", (value,))
+        return batch
+
+    def submit(self, *batches):
+        # Holding the lock keeps the writer thread from flushing in between
+        with self.writer.executing:
+            for batch, key in batches:
+                self.writer.submit(batch, key=key)
+        self.writer.flush()
+
+    def test_keyed_replaces_pending(self):
+        self.submit((self.batch(1), "listeners"), (self.batch(2), "listeners"))
+        self.assertEqual(self.writes, [self.batch(2).statements])
+
+    def test_keyed_skips_repeat(self):
+        self.submit((self.batch(1), "listeners"))
+        self.submit((self.batch(1), "listeners"))
+        self.assertEqual(len(self.writes), 1)
+
+    def test_unkeyed_keeps_everything(self):
+        self.submit((self.batch(1), None), (self.batch(1), None))
+        self.assertEqual(len(self.writes), 2)
+
+    def test_retry(self):
+        self.failures = 2
+        self.submit((self.batch(1), None))
+        self.assertEqual(len(self.writes), 1)
+
+    def test_drop_after_retries(self):
+        self.failures = self.writer.retries + 1
+        self.submit((self.batch(1), "listeners"))
+        self.assertEqual(self.writes, [])
+        self.assertNotIn("listeners", self.writer.written)
+
+
+if __name__ == "__main__":
+    unittest.main()